@@ -4,15 +4,33 @@ from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 import os
+import time
+import uuid
+import hashlib
+import threading
 from db import SessionLocal
 from models import User, TokenBlacklist
+from cache import TTLCache
+from metrics import timed, cache_event
 from typing import Optional
 SECRET_KEY = os.environ.get('APP_SECRET_KEY', 'change_this_secret')
 ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', '60'))  # default 60 minutes
+REVOCATION_REFRESH_SECONDS = float(os.environ.get('REVOCATION_REFRESH_SECONDS', '30'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+BLACKLIST_PURGE_SECONDS = float(os.environ.get('BLACKLIST_PURGE_SECONDS', '3600'))
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/auth/token')
+_user_cache = TTLCache(maxsize=4096, ttl=USER_CACHE_TTL)
+_revoked = set()
+_revoked_local = set()
+_revoked_loaded_at = None
+_users_checked_at = None
+_revoked_lock = threading.Lock()
+_purge_stop = threading.Event()
+_purge_thread = None
 def get_db():
     db = SessionLocal()
     try:
@@ -27,7 +45,9 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[Use
     user = db.query(User).filter(User.username == username).first()
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    with timed('password_verify'):
+        valid = verify_password(password, user.hashed_password)
+    if not valid:
         return None
     return user
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -36,21 +56,100 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({'exp': expire, 'sub': data.get('sub')})
+    to_encode.update({'exp': expire, 'sub': data.get('sub'), 'jti': uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+def _legacy_jti(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+def token_jti(payload: dict, token: str) -> str:
+    return payload.get('jti') or _legacy_jti(token)
+def _refresh_revocations(force: bool = False):
+    global _revoked, _revoked_loaded_at, _users_checked_at
+    now = time.monotonic()
+    if not force and _revoked_loaded_at is not None and now - _revoked_loaded_at < REVOCATION_REFRESH_SECONDS:
+        return
+    with _revoked_lock:
+        if not force and _revoked_loaded_at is not None and now - _revoked_loaded_at < REVOCATION_REFRESH_SECONDS:
+            return
+        checked_at = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            rows = db.query(TokenBlacklist.jti, TokenBlacklist.token).filter((TokenBlacklist.expires_at.is_(None)) | (TokenBlacklist.expires_at > datetime.utcnow())).all()
+            changed = db.query(User.username).filter(User.updated_at >= _users_checked_at).all() if _users_checked_at is not None else []
+        finally:
+            db.close()
+        snapshot = {jti or _legacy_jti(token) for jti, token in rows}
+        _revoked_local.difference_update(snapshot)
+        _revoked = snapshot | _revoked_local
+        for (username,) in changed:
+            _user_cache.pop(username)
+        _users_checked_at = checked_at
+        _revoked_loaded_at = time.monotonic()
+def is_token_revoked(jti: str) -> bool:
+    _refresh_revocations()
+    return jti in _revoked
 def is_token_blacklisted(db: Session, token: str) -> bool:
-    t = db.query(TokenBlacklist).filter(TokenBlacklist.token == token).first()
-    return t is not None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={'verify_exp': False})
+    except JWTError:
+        return False
+    return is_token_revoked(token_jti(payload, token))
 def blacklist_token(db: Session, token: str, expires_at: datetime = None):
-    existing = db.query(TokenBlacklist).filter(TokenBlacklist.token == token).first()
-    if existing:
-        return existing
-    tb = TokenBlacklist(token=token, expires_at=expires_at)
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={'verify_exp': False})
+    jti = token_jti(payload, token)
+    if expires_at is None and payload.get('exp'):
+        expires_at = datetime.utcfromtimestamp(payload['exp'])
+    tb = TokenBlacklist(token=token, jti=jti, expires_at=expires_at)
     db.add(tb)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        tb = db.query(TokenBlacklist).filter(TokenBlacklist.jti == jti).first()
+    with _revoked_lock:
+        _revoked_local.add(jti)
+        _revoked.add(jti)
     return tb
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def purge_expired_blacklist() -> int:
+    db = SessionLocal()
+    try:
+        n = db.query(TokenBlacklist).filter(TokenBlacklist.expires_at < datetime.utcnow()).delete(synchronize_session=False)
+        db.commit()
+        return n
+    finally:
+        db.close()
+def _purge_loop():
+    while not _purge_stop.wait(BLACKLIST_PURGE_SECONDS):
+        try:
+            purge_expired_blacklist()
+        except Exception:
+            pass
+def start_blacklist_purger():
+    global _purge_thread
+    if _purge_thread is None or not _purge_thread.is_alive():
+        _purge_stop.clear()
+        _purge_thread = threading.Thread(target=_purge_loop, name='blacklist-purger', daemon=True)
+        _purge_thread.start()
+def stop_blacklist_purger():
+    _purge_stop.set()
+def invalidate_user(username: str):
+    _user_cache.pop(username)
+def _load_user(username: str) -> Optional[User]:
+    user = _user_cache.get(username)
+    cache_event('user', user is not None)
+    if user is not None:
+        return user
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+        if user is not None:
+            db.expunge(user)
+            _user_cache.set(username, user)
+        return user
+    finally:
+        db.close()
+@timed('auth')
+def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials', headers={'WWW-Authenticate': 'Bearer'})
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -59,9 +158,9 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    if is_token_blacklisted(db, token):
+    if is_token_revoked(token_jti(payload, token)):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Token has been revoked')
-    user = db.query(User).filter(User.username == username).first()
+    user = _load_user(username)
     if user is None:
         raise credentials_exception
     return user
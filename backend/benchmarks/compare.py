@@ -0,0 +1,50 @@
+import sys
+import json
+import argparse
+from typing import Dict, Iterator, Tuple
+HIGHER_IS_BETTER = ('rps', 'per_second')
+LOWER_IS_BETTER = ('_ms', 'seconds', '_mb')
+def _flatten(results: Dict, prefix: str = '') -> Iterator[Tuple[str, float]]:
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{name}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, float(value)
+def direction(metric: str) -> int:
+    if metric.endswith(HIGHER_IS_BETTER):
+        return 1
+    if metric.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+def compare(base: Dict, new: Dict, threshold: float) -> Tuple[list, list]:
+    old = dict(_flatten(base['results']))
+    rows, regressions = [], []
+    for metric, value in _flatten(new['results']):
+        sign = direction(metric)
+        if metric not in old or sign == 0:
+            continue
+        prev = old[metric]
+        change = (value - prev) / prev if prev else 0.0
+        regressed = sign * change < -threshold
+        rows.append((metric, prev, value, change, regressed))
+        if regressed:
+            regressions.append(metric)
+    return rows, regressions
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative change that counts as a regression')
+    args = parser.parse_args(argv)
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows, regressions = compare(base, new, args.threshold)
+    for metric, prev, value, change, regressed in rows:
+        print(f"{metric:50s} {prev:12.3f} -> {value:12.3f} {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+    print(f"{len(regressions)} regression(s) over {args.threshold:.0%} ({base['meta'].get('commit') or '?'} -> {new['meta'].get('commit') or '?'})")
+    return 1 if regressions else 0
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic import create_schema, questions
+from benchmarks.stub_server import start_stub_server
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {'count': 0}
+    arr = np.asarray(latencies) * 1000.0
+    return {'count': len(latencies), 'mean_ms': float(arr.mean()), 'p50_ms': float(np.percentile(arr, 50)), 'p95_ms': float(np.percentile(arr, 95)), 'p99_ms': float(np.percentile(arr, 99)), 'max_ms': float(arr.max())}
+def timed_calls(fn: Callable, args: List, concurrency: int = 1) -> Dict:
+    def one(a):
+        started = time.perf_counter()
+        ok = fn(a)
+        return time.perf_counter() - started, ok
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, args))
+    wall = time.perf_counter() - started
+    out = summarize([r[0] for r in results])
+    out.update({'errors': sum(1 for _, ok in results if not ok), 'wall_seconds': wall, 'rps': len(results) / wall if wall else 0.0})
+    return out
+def peak_memory(fn: Callable) -> Dict[str, float]:
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'python_peak_mb': peak / 2 ** 20}
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return ''
+def configure_env(args, workdir: str, stub_url: str):
+    defaults = {
+        'APP_DB_PATH': os.path.join(workdir, 'app.db'),
+        'VECTOR_BACKEND': 'numpy',
+        'VECTOR_INDEX_DIR': os.path.join(workdir, 'vectors'),
+        'JOIN_GRAPH_DIR': os.path.join(workdir, 'join_graphs'),
+        'CHROMA_PERSIST_DIR': os.path.join(workdir, 'chroma'),
+        'OLLAMA_URL': stub_url,
+        'LLM_MAX_CONCURRENCY': str(args.concurrency),
+        'LLM_MAX_QUEUE': str(args.requests),
+        'QUERY_MAX_PER_USER': str(args.concurrency),
+        'QUERY_MAX_PER_TARGET': str(args.concurrency),
+        'QUERY_MAX_QUEUE': str(args.requests),
+        'APP_SECRET_KEY': 'benchmark',
+    }
+    if args.embeddings == 'stub':
+        defaults['EMBEDDING_SERVICE_URL'] = stub_url
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+def run(args) -> Dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench-')
+    os.makedirs(workdir, exist_ok=True)
+    server, stub_url = start_stub_server(args.llm_latency_ms, args.token_latency_ms)
+    configure_env(args, workdir, stub_url)
+    target = args.dsn or f"sqlite:///{os.path.join(workdir, 'target.db')}"
+    schema = args.schema or ('main' if target.startswith('sqlite') else 'bench')
+    results = {}
+    if args.dsn and not target.startswith('sqlite'):
+        from sqlalchemy import create_engine, text
+        engine = create_engine(target)
+        with engine.begin() as conn:
+            conn.execute(text(f'DROP SCHEMA IF EXISTS {schema} CASCADE'))
+            conn.execute(text(f'CREATE SCHEMA {schema}'))
+        engine.dispose()
+        results['synthetic_schema'] = create_schema(target, args.tables, args.columns, args.fk_density, args.rows, args.seed, schema=schema)
+    else:
+        results['synthetic_schema'] = create_schema(target, args.tables, args.columns, args.fk_density, args.rows, args.seed)
+    from fastapi.testclient import TestClient
+    import main
+    from db import SessionLocal
+    from models import User
+    from auth import create_access_token
+    from connectors.factory import get_connector
+    from connectors.postgres_connector import BULK_EXTRACTION
+    from join_graph import build_join_graph
+    from vector_indexer import upsert_metadata_embeddings, semantic_search
+    from hybrid_retriever import retrieve_context
+    with TestClient(main.app) as client:
+        db = SessionLocal()
+        if db.query(User).filter(User.username == 'bench').first() is None:
+            db.add(User(username='bench', hashed_password='!', role='admin'))
+            db.commit()
+        db.close()
+        token = create_access_token(data={'sub': 'bench'})
+        headers = {'Authorization': f'Bearer {token}'}
+        started = time.perf_counter()
+        connector = get_connector('postgresql', target, schema)
+        connector.connect()
+        entries = connector.extract_metadata()
+        extract_seconds = time.perf_counter() - started
+        extraction_path = 'pg_catalog' if BULK_EXTRACTION and connector.engine.dialect.name == 'postgresql' else 'inspector'
+        results['extraction'] = {'entries': len(entries), 'seconds': extract_seconds, 'tables_per_second': len(entries) / extract_seconds if extract_seconds else 0.0, 'path': extraction_path}
+        started = time.perf_counter()
+        build_join_graph(schema, entries)
+        graph_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        stats = upsert_metadata_embeddings(schema, entries)
+        index_seconds = time.perf_counter() - started
+        indexed = stats['added'] + stats['changed']
+        results['indexing'] = {**stats, 'seconds': index_seconds, 'join_graph_seconds': graph_seconds, 'entries_per_second': indexed / index_seconds if index_seconds else 0.0}
+        started = time.perf_counter()
+        resp = client.post('/extract_metadata', json={'conn_str': target, 'schema': schema, 'db_type': 'postgresql'}, headers=headers)
+        results['reindex_unchanged'] = {'seconds': time.perf_counter() - started, 'status': resp.status_code, 'skipped': resp.json().get('skipped')}
+        search_questions = questions(args.tables, args.searches, args.seed)
+        results['semantic_search'] = timed_calls(lambda q: bool(semantic_search(schema, q, 6)), search_questions)
+        results['semantic_search_cached'] = timed_calls(lambda q: bool(semantic_search(schema, q, 6)), search_questions)
+        results['hybrid_retrieve'] = timed_calls(lambda q: bool(retrieve_context(schema, q, 6)), questions(args.tables, args.searches, args.seed + 1))
+        gen_questions = questions(args.tables, args.requests, args.seed + 2)
+        def generate(q: str) -> bool:
+            r = client.post('/generate_sql', json={'conn_str': target, 'schema': schema, 'question': q, 'top_k': 6}, headers=headers)
+            return r.status_code == 200
+        results['generate_sql_cold'] = timed_calls(generate, gen_questions, args.concurrency)
+        results['generate_sql_cached'] = timed_calls(generate, gen_questions, args.concurrency)
+        fact = f"{schema}.{results['synthetic_schema']['fact_table']}"
+        sql = f'SELECT * FROM {fact}'
+        def execute(fmt: str, no_cache: bool) -> Callable:
+            def call(_) -> bool:
+                r = client.post('/execute_sql', json={'conn_str': target, 'sql': sql, 'format': fmt, 'no_cache': no_cache}, headers=headers)
+                return r.status_code == 200
+            return call
+        reps = list(range(args.executions))
+        for fmt in ('json', 'arrow'):
+            results[f'execute_sql_{fmt}'] = {**timed_calls(execute(fmt, True), reps, args.concurrency), **peak_memory(lambda: execute(fmt, True)(None))}
+            results[f'execute_sql_{fmt}_cached'] = timed_calls(execute(fmt, False), reps, args.concurrency)
+        def stream(_) -> bool:
+            r = client.post('/execute_sql/stream', json={'conn_str': target, 'sql': sql, 'format': 'ndjson'}, headers=headers)
+            return r.status_code == 200
+        results['execute_sql_stream_ndjson'] = {**timed_calls(stream, reps[:max(1, len(reps) // 5)]), **peak_memory(lambda: stream(None))}
+        metrics_text = client.get('/metrics').text
+    server.shutdown()
+    results['process'] = {'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+    return {'meta': {'timestamp': datetime.utcnow().isoformat(), 'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(), 'target': 'postgres' if args.dsn and not target.startswith('sqlite') else 'sqlite', 'workdir': workdir}, 'params': {k: v for k, v in vars(args).items() if k not in ('dsn', 'out')}, 'results': results, 'metrics_lines': len(metrics_text.splitlines())}
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark for the metadata-to-SQL backend', epilog='Without --dsn the target is SQLite, so metadata extraction goes through the SQLAlchemy inspector fallback; pass a Postgres URL to --dsn to measure the pg_catalog bulk extraction path.')
+    parser.add_argument('--tables', type=int, default=100, help='number of synthetic tables (100 to 50000)')
+    parser.add_argument('--columns', type=int, default=12, help='non-key columns per table; raise for wide tables')
+    parser.add_argument('--fk-density', type=float, default=1.5, help='average foreign keys per table')
+    parser.add_argument('--rows', type=int, default=20000, help='rows loaded into the fact table used by /execute_sql')
+    parser.add_argument('--searches', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=200, help='/generate_sql requests per phase')
+    parser.add_argument('--executions', type=int, default=50, help='/execute_sql requests per format')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--llm-latency-ms', type=float, default=50.0)
+    parser.add_argument('--token-latency-ms', type=float, default=0.0)
+    parser.add_argument('--embeddings', choices=['stub', 'model'], default='stub', help='stub uses hashed embeddings from the stub server; model loads sentence-transformers')
+    parser.add_argument('--dsn', default='', help='Postgres URL to use instead of a local SQLite target; required to benchmark pg_catalog bulk extraction')
+    parser.add_argument('--schema', default='')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--workdir', default='')
+    parser.add_argument('--out', default='bench_results.json')
+    return parser.parse_args(argv)
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    for name, values in report['results'].items():
+        shown = {k: round(v, 3) if isinstance(v, float) else v for k, v in values.items() if k in ('seconds', 'p50_ms', 'p99_ms', 'rps', 'entries_per_second', 'python_peak_mb', 'errors', 'max_rss_mb')}
+        print(f'{name:28s} {shown}')
+    if report['results']['extraction']['path'] != 'pg_catalog':
+        print('Metadata extraction used the inspector fallback; pass --dsn with a Postgres URL to measure pg_catalog bulk extraction')
+    print(f'Results written to {args.out}')
+if __name__ == '__main__':
+    main()
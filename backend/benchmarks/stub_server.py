@@ -0,0 +1,76 @@
+import re
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+_TABLE_RE = re.compile(r'^- (?:view )?([\w$.]+)\(', re.M)
+_WORD_RE = re.compile(r'[a-z0-9]+')
+def stub_sql(prompt: str) -> str:
+    m = _TABLE_RE.search(prompt or '')
+    return f'SELECT * FROM {m.group(1)} LIMIT 100;' if m else 'SELECT 1;'
+def hashed_embedding(text: str, dim: int) -> List[float]:
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in _WORD_RE.findall((text or '').lower()):
+        h = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = float(np.linalg.norm(vec))
+    return (vec / norm if norm else vec).tolist()
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.05
+    token_latency = 0.0
+    dim = 384
+    def log_message(self, *args):
+        pass
+    def _json(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+    def _send(self, body: bytes, content_type: str = 'application/json'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def do_POST(self):
+        payload = self._json()
+        if self.path == '/encode':
+            self._send(json.dumps({'embeddings': [hashed_embedding(t, self.dim) for t in payload.get('texts') or []]}).encode('utf-8'))
+        elif self.path == '/api/generate':
+            time.sleep(self.latency)
+            sql = stub_sql(payload.get('prompt'))
+            if not payload.get('stream'):
+                self._send(json.dumps({'model': payload.get('model'), 'response': sql, 'done': True}).encode('utf-8'))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for token in [t + ' ' for t in sql.split(' ')]:
+                time.sleep(self.token_latency)
+                self._chunk(json.dumps({'response': token, 'done': False}) + '\n')
+            self._chunk(json.dumps({'response': '', 'done': True}) + '\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_error(404)
+    def _chunk(self, text: str):
+        data = text.encode('utf-8')
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+def start_stub_server(latency_ms: float = 50.0, token_latency_ms: float = 0.0, dim: int = 384, port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'latency': latency_ms / 1000.0, 'token_latency': token_latency_ms / 1000.0, 'dim': dim})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='bench-stub-server', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Stub Ollama /api/generate and embedding /encode server')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--token-latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    server, url = start_stub_server(args.latency_ms, args.token_latency_ms, port=args.port)
+    print(f'Stub server listening on {url}')
+    threading.Event().wait()
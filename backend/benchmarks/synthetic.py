@@ -0,0 +1,57 @@
+import time
+import random
+from typing import Dict, List
+from sqlalchemy import Column, Date, ForeignKey, Integer, MetaData, Numeric, String, Table, Text, create_engine, insert
+NOUNS = ['customer', 'order', 'invoice', 'payment', 'product', 'supplier', 'shipment', 'warehouse', 'employee', 'department', 'account', 'ledger', 'campaign', 'lead', 'ticket', 'store', 'region', 'contract', 'asset', 'subscription']
+ATTRIBUTES = [('status', String(32)), ('amount', Numeric(12, 2)), ('quantity', Integer), ('created_on', Date), ('name', String(128)), ('description', Text), ('country', String(64)), ('price', Numeric(10, 2)), ('score', Integer), ('category', String(64)), ('email', String(128)), ('discount', Numeric(5, 2))]
+TABLE_CREATE_BATCH = 500
+def table_name(i: int) -> str:
+    return f'{NOUNS[i % len(NOUNS)]}_{i:05d}'
+def build_metadata(tables: int, columns: int, fk_density: float, seed: int = 7, schema: str = None) -> MetaData:
+    rng = random.Random(seed)
+    md = MetaData(schema=schema)
+    prefix = f'{schema}.' if schema else ''
+    for i in range(tables):
+        cols = [Column('id', Integer, primary_key=True)]
+        n_fks = min(i, int(fk_density) + (rng.random() < fk_density % 1))
+        for ref in sorted(rng.sample(range(i), n_fks)) if n_fks else []:
+            cols.append(Column(f'{table_name(ref)}_id', Integer, ForeignKey(f'{prefix}{table_name(ref)}.id')))
+        for c in range(columns):
+            name, type_ = ATTRIBUTES[(i + c) % len(ATTRIBUTES)]
+            cols.append(Column(f'{name}_{c}' if c >= len(ATTRIBUTES) else name, type_))
+        Table(table_name(i), md, *cols)
+    return md
+def create_schema(url: str, tables: int, columns: int, fk_density: float, rows: int, seed: int = 7, schema: str = None) -> Dict:
+    started = time.perf_counter()
+    engine = create_engine(url)
+    md = build_metadata(tables, columns, fk_density, seed, schema)
+    ordered = list(md.sorted_tables)
+    for i in range(0, len(ordered), TABLE_CREATE_BATCH):
+        md.create_all(engine, tables=ordered[i:i + TABLE_CREATE_BATCH])
+    fact = md.tables[f'{schema}.{table_name(0)}' if schema else table_name(0)]
+    rng = random.Random(seed)
+    with engine.begin() as conn:
+        for start in range(0, rows, 10000):
+            conn.execute(insert(fact), [_fake_row(fact, start + k, rng) for k in range(min(10000, rows - start))])
+    engine.dispose()
+    return {'tables': tables, 'columns_per_table': columns + 1, 'foreign_keys': sum(len(t.foreign_keys) for t in ordered), 'fact_table': fact.name, 'fact_rows': rows, 'seconds': time.perf_counter() - started}
+def _fake_row(table: Table, row_id: int, rng: random.Random) -> Dict:
+    row = {}
+    for c in table.columns:
+        if c.name == 'id':
+            row[c.name] = row_id + 1
+        elif isinstance(c.type, (Integer, Numeric)):
+            row[c.name] = round(rng.random() * 1000, 2)
+        elif isinstance(c.type, Date):
+            row[c.name] = None
+        else:
+            row[c.name] = rng.choice(NOUNS)
+    return row
+def questions(tables: int, n: int, seed: int = 11) -> List[str]:
+    rng = random.Random(seed)
+    templates = ['Show total amount by status for {noun} {i}', 'Which {noun} records in {noun} {i} have the highest score', 'Count {noun} rows per country in table {i}', 'List recent {noun} entries with price above 100 for {i}', 'Average quantity per category of {noun} {i}']
+    out = []
+    for k in range(n):
+        i = rng.randrange(tables)
+        out.append(rng.choice(templates).format(noun=NOUNS[i % len(NOUNS)], i=i) + f' (variant {k})')
+    return out
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import List, Dict, Iterator
 class BaseConnector(ABC):
     def __init__(self, connection_string: str, schema: str):
         self.connection_string = connection_string
@@ -10,3 +10,5 @@ class BaseConnector(ABC):
     @abstractmethod
     def extract_metadata(self) -> List[Dict]:
         pass
+    def iter_metadata(self) -> Iterator[Dict]:
+        return iter(self.extract_metadata())
@@ -1,40 +1,106 @@
+import os
+from itertools import groupby
 from .base_connector import BaseConnector
-from sqlalchemy import create_engine, inspect
-from typing import List, Dict
+from sqlalchemy import inspect, text
+from engine_registry import get_engine
+from metrics import timed
+from typing import List, Dict, Iterator
+BULK_EXTRACTION = os.environ.get('PG_BULK_EXTRACTION', '1') == '1'
+_RELATIONS_SQL = text("""
+SELECT c.oid, c.relname, c.relkind,
+       obj_description(c.oid, 'pg_class') AS comment,
+       CASE WHEN c.relkind IN ('v', 'm') THEN pg_get_viewdef(c.oid, true) END AS definition
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = :schema AND c.relkind IN ('r', 'p', 'f', 'v', 'm')
+ORDER BY c.oid
+""")
+_CONSTRAINTS_SQL = text("""
+SELECT con.conrelid, con.conname, con.contype, rn.nspname AS referred_schema, rc.relname AS referred_table,
+       ARRAY(SELECT a.attname FROM unnest(con.conkey) WITH ORDINALITY k(attnum, ord)
+             JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum ORDER BY k.ord) AS columns,
+       ARRAY(SELECT a.attname FROM unnest(con.confkey) WITH ORDINALITY k(attnum, ord)
+             JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum ORDER BY k.ord) AS referred_columns
+FROM pg_constraint con
+JOIN pg_class c ON c.oid = con.conrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_class rc ON rc.oid = con.confrelid
+LEFT JOIN pg_namespace rn ON rn.oid = rc.relnamespace
+WHERE n.nspname = :schema AND con.contype IN ('p', 'f')
+ORDER BY con.conrelid, con.conname
+""")
+_COLUMNS_SQL = text("""
+SELECT a.attrelid, a.attname, format_type(a.atttypid, a.atttypmod) AS type, NOT a.attnotnull AS nullable,
+       col_description(a.attrelid, a.attnum) AS comment
+FROM pg_attribute a
+JOIN pg_class c ON c.oid = a.attrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = :schema AND c.relkind IN ('r', 'p', 'f', 'v', 'm') AND a.attnum > 0 AND NOT a.attisdropped
+ORDER BY a.attrelid, a.attnum
+""")
 class PostgresConnector(BaseConnector):
+    @timed('connector_connect')
     def connect(self):
-        self.engine = create_engine(self.connection_string)
+        self.engine = get_engine(self.connection_string)
         self.inspector = inspect(self.engine)
     def extract_metadata(self) -> List[Dict]:
-        metadata_entries = []
+        return list(self.iter_metadata())
+    def iter_metadata(self) -> Iterator[Dict]:
+        if BULK_EXTRACTION and self.engine.dialect.name == 'postgresql':
+            return self._iter_catalog_metadata()
+        return self._iter_inspector_metadata()
+    def _entry(self, name: str, kind: str, cols: List[Dict], fks: List[Dict], **extra) -> Dict:
+        readable = f"{kind.capitalize()} {self.schema}.{name}: " + ", ".join([f"{c['name']} ({c['type']})" for c in cols])
+        if extra.get('comment'):
+            readable += f" -- {extra['comment']}"
+        entry = {'id': f"{self.schema}.{name}", 'type': kind, 'name': name, 'schema': self.schema, 'columns': cols, 'foreign_keys': fks}
+        entry.update(extra)
+        entry['readable'] = readable
+        return entry
+    def _iter_catalog_metadata(self) -> Iterator[Dict]:
+        params = {'schema': self.schema}
+        with self.engine.connect() as conn:
+            with timed('connector_catalog'):
+                relations = conn.execute(_RELATIONS_SQL, params).fetchall()
+                pks, fks = {}, {}
+                for row in conn.execute(_CONSTRAINTS_SQL, params):
+                    if row.contype == 'p':
+                        pks[row.conrelid] = list(row.columns)
+                    else:
+                        fks.setdefault(row.conrelid, []).append({
+                            'name': row.conname,
+                            'constrained_columns': list(row.columns),
+                            'referred_schema': row.referred_schema,
+                            'referred_table': row.referred_table,
+                            'referred_columns': list(row.referred_columns),
+                            'options': {}
+                        })
+            col_rows = conn.execution_options(stream_results=True, yield_per=2000).execute(_COLUMNS_SQL, params)
+            col_groups = groupby(col_rows, key=lambda r: r.attrelid)
+            pending = next(col_groups, None)
+            for rel in relations:
+                cols = []
+                while pending is not None and pending[0] <= rel.oid:
+                    if pending[0] == rel.oid:
+                        cols = [{'name': r.attname, 'type': r.type, 'nullable': r.nullable, 'comment': r.comment} for r in pending[1]]
+                    pending = next(col_groups, None)
+                kind = 'table' if rel.relkind in ('r', 'p', 'f') else 'view'
+                yield self._entry(rel.relname, kind, cols, fks.get(rel.oid, []), primary_key=pks.get(rel.oid, []), comment=rel.comment, ddl=rel.definition)
+    def _iter_inspector_metadata(self) -> Iterator[Dict]:
         for table_name in self.inspector.get_table_names(schema=self.schema):
             cols = []
-            for col in self.inspector.get_columns(table_name, schema=self.schema):
-                cols.append({'name': col.get('name'), 'type': str(col.get('type'))})
-            fks = self.inspector.get_foreign_keys(table_name, schema=self.schema)
-            metadata_entries.append({
-                'id': f"{self.schema}.{table_name}",
-                'type': 'table',
-                'name': table_name,
-                'schema': self.schema,
-                'columns': cols,
-                'foreign_keys': fks,
-                'readable': f"Table {self.schema}.{table_name}: " + ", ".join([f"{c['name']} ({c['type']})" for c in cols])
-            })
+            with timed('connector_reflect'):
+                for col in self.inspector.get_columns(table_name, schema=self.schema):
+                    cols.append({'name': col.get('name'), 'type': str(col.get('type'))})
+                fks = self.inspector.get_foreign_keys(table_name, schema=self.schema)
+            yield self._entry(table_name, 'table', cols, fks)
         try:
-            for view_name in self.inspector.get_view_names(schema=self.schema):
-                cols = []
+            view_names = self.inspector.get_view_names(schema=self.schema)
+        except Exception:
+            view_names = []
+        for view_name in view_names:
+            cols = []
+            with timed('connector_reflect'):
                 for col in self.inspector.get_columns(view_name, schema=self.schema):
                     cols.append({'name': col.get('name'), 'type': str(col.get('type'))})
-                metadata_entries.append({
-                    'id': f"{self.schema}.{view_name}",
-                    'type': 'view',
-                    'name': view_name,
-                    'schema': self.schema,
-                    'columns': cols,
-                    'foreign_keys': [],
-                    'readable': f"View {self.schema}.{view_name}: " + ", ".join([f"{c['name']} ({c['type']})" for c in cols])
-                })
-        except Exception:
-            pass
-        return metadata_entries
+            yield self._entry(view_name, 'view', cols, [])
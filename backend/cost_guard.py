@@ -0,0 +1,100 @@
+import os
+import json
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from cache import TTLCache
+from metrics import timed, cache_event
+from engine_registry import get_engine, connection_fingerprint, dialect_name
+from sql_safety import analyze_sql, LIMITABLE_STATEMENTS
+from query_control import admitted, tracked_connection, AdmissionError
+EXPLAIN_ENABLED = os.environ.get('EXPLAIN_ENABLED', '1') == '1'
+EXPLAIN_CACHE_TTL = float(os.environ.get('EXPLAIN_CACHE_TTL', '300'))
+COST_LIMIT_DEFAULTS = {'EXPLAIN_CONFIRM_COST': '100000', 'EXPLAIN_MAX_COST': '10000000', 'EXPLAIN_CONFIRM_ROWS': '1000000', 'EXPLAIN_MAX_ROWS': '0'}
+_plan_cache = TTLCache(maxsize=1024, ttl=EXPLAIN_CACHE_TTL)
+class CostLimitError(Exception):
+    def __init__(self, reason: str, plan: Dict, needs_confirmation: bool):
+        super().__init__(reason)
+        self.reason = reason
+        self.plan = plan
+        self.needs_confirmation = needs_confirmation
+def role_limits(role: str) -> Dict[str, float]:
+    suffix = (role or 'analyst').upper()
+    return {name.lower().replace('explain_', ''): float(os.environ.get(f'{name}_{suffix}', os.environ.get(name, default))) for name, default in COST_LIMIT_DEFAULTS.items()}
+def _walk(node: Dict, out: List[Dict]):
+    out.append(node)
+    for child in node.get('Plans') or []:
+        _walk(child, out)
+def _postgres_plan(conn, sql: str) -> Dict:
+    raw = conn.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+    nodes = []
+    _walk(plan, nodes)
+    source = plan['Plans'][0] if plan.get('Node Type') == 'Limit' and plan.get('Plans') else plan
+    return {'total_cost': plan.get('Total Cost'), 'rows': source.get('Plan Rows'), 'limit_rows': plan.get('Plan Rows') if source is not plan else None, 'node_type': plan.get('Node Type'), 'seq_scans': sorted({n['Relation Name'] for n in nodes if n.get('Node Type') == 'Seq Scan' and n.get('Relation Name')}), 'nested_loops': sum(1 for n in nodes if n.get('Node Type') == 'Nested Loop' and not n.get('Join Filter'))}
+def _mysql_plan(conn, sql: str) -> Dict:
+    raw = conn.execute(text(f'EXPLAIN FORMAT=JSON {sql}')).scalar()
+    block = json.loads(raw).get('query_block', {})
+    cost = (block.get('cost_info') or {}).get('query_cost')
+    return {'total_cost': float(cost) if cost is not None else None, 'rows': None, 'node_type': None}
+def _sqlite_plan(conn, sql: str) -> Dict:
+    details = [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()]
+    return {'total_cost': None, 'rows': None, 'node_type': None, 'steps': details, 'seq_scans': [d.split()[1] for d in details if d.startswith('SCAN ') and d != 'SCAN CONSTANT ROW' and len(d.split()) > 1]}
+PLANNERS = {'postgresql': _postgres_plan, 'mysql': _mysql_plan, 'mariadb': _mysql_plan, 'sqlite': _sqlite_plan}
+def explain_sql(conn_str: str, sql_to_run: str, user_id=None, role: Optional[str] = None, cached_only: bool = False) -> Optional[Dict]:
+    if not EXPLAIN_ENABLED or analyze_sql(sql_to_run, dialect_name(conn_str)).statement_type not in LIMITABLE_STATEMENTS:
+        return None
+    key = (connection_fingerprint(conn_str), sql_to_run)
+    cached = _plan_cache.get(key)
+    cache_event('explain', cached is not None)
+    if cached is not None or cached_only:
+        return dict(cached) if cached is not None else None
+    engine = get_engine(conn_str)
+    planner = PLANNERS.get(engine.dialect.name)
+    if planner is None:
+        return None
+    with timed('explain'), admitted(conn_str, user_id), tracked_connection(conn_str, user_id=user_id, role=role) as conn:
+        summary = planner(conn, sql_to_run.strip().rstrip(';'))
+    summary['dialect'] = engine.dialect.name
+    _plan_cache.set(key, summary)
+    return dict(summary)
+def evaluate_plan(plan: Optional[Dict], role: str) -> Dict:
+    if not plan:
+        return {'verdict': 'unknown', 'reason': None}
+    limits = role_limits(role)
+    cost, rows = plan.get('total_cost'), plan.get('rows')
+    for metric, value in (('cost', cost), ('rows', rows)):
+        cap = limits[f'max_{metric}']
+        if value is not None and cap and value > cap:
+            return {'verdict': 'reject', 'reason': f'Estimated {metric} {value:,.0f} exceeds the limit of {cap:,.0f} for role {role}'}
+    for metric, value in (('cost', cost), ('rows', rows)):
+        cap = limits[f'confirm_{metric}']
+        if value is not None and cap and value > cap:
+            return {'verdict': 'confirm', 'reason': f'Estimated {metric} {value:,.0f} exceeds {cap:,.0f}; confirmation required'}
+    return {'verdict': 'ok', 'reason': None}
+def unplanned(role: str, error: Exception) -> Dict:
+    limits = role_limits(role)
+    plan = {'total_cost': None, 'rows': None, 'node_type': None, 'error': str(error)}
+    if limits['max_cost'] or limits['max_rows']:
+        plan.update(verdict='reject', reason=f'Could not estimate the cost of this query ({error}); role {role} has a cost limit')
+    else:
+        plan.update(verdict='confirm', reason=f'Could not estimate the cost of this query ({error}); confirmation required')
+    return plan
+def plan_query(conn_str: str, sql_to_run: str, role: str, user_id=None, cached_only: bool = False) -> Optional[Dict]:
+    try:
+        plan = explain_sql(conn_str, sql_to_run, user_id=user_id, role=role, cached_only=cached_only)
+    except AdmissionError:
+        raise
+    except Exception as e:
+        return unplanned(role, e)
+    if plan is not None:
+        plan.update(evaluate_plan(plan, role))
+    return plan
+def preflight(conn_str: str, sql_to_run: str, role: str, confirm: bool = False, user_id=None) -> Optional[Dict]:
+    plan = plan_query(conn_str, sql_to_run, role, user_id=user_id)
+    if plan is None:
+        return None
+    if plan['verdict'] == 'reject':
+        raise CostLimitError(plan['reason'], plan, needs_confirmation=False)
+    if plan['verdict'] == 'confirm' and not confirm:
+        raise CostLimitError(plan['reason'], plan, needs_confirmation=True)
+    return plan
@@ -10,7 +10,12 @@ def create_initial_admin():
     password = getpass("Enter admin password (hidden): ").strip()
     existing = db.query(User).filter(User.username == username).first()
     if existing:
-        print(f"User '{username}' already exists.")
+        if existing.role != 'admin':
+            existing.role = 'admin'
+            db.commit()
+            print(f"User '{username}' already exists; promoted to admin.")
+        else:
+            print(f"User '{username}' already exists.")
         return
     hashed_pw = get_password_hash(password)
     admin = User(username=username, hashed_password=hashed_pw, role='admin')
@@ -1,10 +1,55 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base, scoped_session
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 DB_PATH = os.environ.get('APP_DB_PATH', '/data/app.db')
 SQLITE_URL = f'sqlite:///{DB_PATH}'
-engine = create_engine(SQLITE_URL, connect_args={"check_same_thread": False})
-SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+APP_DB_POOL_SIZE = int(os.environ.get('APP_DB_POOL_SIZE', '10'))
+APP_DB_MAX_OVERFLOW = int(os.environ.get('APP_DB_MAX_OVERFLOW', '10'))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_PRAGMAS = ['journal_mode=WAL', 'synchronous=NORMAL', f'busy_timeout={SQLITE_BUSY_TIMEOUT_MS}', 'temp_store=MEMORY', 'cache_size=-16000', 'mmap_size=134217728']
+engine = create_engine(SQLITE_URL, connect_args={"check_same_thread": False}, pool_size=APP_DB_POOL_SIZE, max_overflow=APP_DB_MAX_OVERFLOW)
+@event.listens_for(engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f'PRAGMA {pragma}')
+    cursor.close()
+HISTORY_FTS_DDL = [
+    "CREATE VIRTUAL TABLE query_history_fts USING fts5(question, content='query_history', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS query_history_fts_ai AFTER INSERT ON query_history BEGIN INSERT INTO query_history_fts(rowid, question) VALUES (new.id, new.question); END",
+    "CREATE TRIGGER IF NOT EXISTS query_history_fts_ad AFTER DELETE ON query_history BEGIN INSERT INTO query_history_fts(query_history_fts, rowid, question) VALUES ('delete', old.id, old.question); END",
+    "CREATE TRIGGER IF NOT EXISTS query_history_fts_au AFTER UPDATE ON query_history BEGIN INSERT INTO query_history_fts(query_history_fts, rowid, question) VALUES ('delete', old.id, old.question); INSERT INTO query_history_fts(rowid, question) VALUES (new.id, new.question); END",
+    "INSERT INTO query_history_fts(query_history_fts) VALUES ('rebuild')",
+]
+history_fts_enabled = False
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+def _add_missing_columns():
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+def _ensure_history_fts():
+    global history_fts_enabled
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'query_history_fts'")).first()
+            if not exists:
+                for stmt in HISTORY_FTS_DDL:
+                    conn.execute(text(stmt))
+        history_fts_enabled = True
+    except OperationalError:
+        history_fts_enabled = False
+def history_fts_available() -> bool:
+    return history_fts_enabled
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _ensure_history_fts()
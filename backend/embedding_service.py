@@ -0,0 +1,86 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+import requests
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+from fastapi import FastAPI
+from pydantic import BaseModel
+EMBED_MAX_BATCH = int(os.environ.get('EMBED_MAX_BATCH', '64'))
+EMBED_MAX_WAIT_MS = float(os.environ.get('EMBED_MAX_WAIT_MS', '5'))
+EMBEDDING_SERVICE_URL = os.environ.get('EMBEDDING_SERVICE_URL', '')
+EMBEDDING_SERVICE_TIMEOUT = float(os.environ.get('EMBEDDING_SERVICE_TIMEOUT', '30'))
+class MicroBatcher:
+    def __init__(self, encode_fn: Callable[[List[str]], List[List[float]]], max_batch: int = EMBED_MAX_BATCH, max_wait_ms: float = EMBED_MAX_WAIT_MS):
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._thread.start()
+    def submit(self, text: str) -> Future:
+        self._ensure_worker()
+        fut = Future()
+        self._queue.put((text, fut))
+        return fut
+    def encode(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        return self.submit(text).result(timeout)
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                pass
+            try:
+                vectors = self.encode_fn([text for text, _ in batch])
+                if len(vectors) != len(batch):
+                    raise RuntimeError(f'Embedding function returned {len(vectors)} vectors for {len(batch)} texts')
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, fut), vec in zip(batch, vectors):
+                fut.set_result(vec)
+    def stats(self) -> dict:
+        return {'batches': self.batches, 'items': self.items, 'avg_batch': (self.items / self.batches) if self.batches else 0.0, 'queued': self._queue.qsize()}
+_session = requests.Session()
+def remote_encode(texts: List[str]) -> List[List[float]]:
+    resp = _session.post(f'{EMBEDDING_SERVICE_URL}/encode', json={'texts': texts}, timeout=EMBEDDING_SERVICE_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()['embeddings']
+class EncodeIn(BaseModel):
+    texts: List[str]
+service_app = FastAPI(title='Embedding Service')
+_service_batcher = None
+def _get_service_batcher() -> MicroBatcher:
+    global _service_batcher
+    if _service_batcher is None:
+        from vector_indexer import _get_model
+        model = _get_model()
+        _service_batcher = MicroBatcher(lambda texts: model.encode(texts, show_progress_bar=False, convert_to_numpy=True).tolist())
+    return _service_batcher
+@service_app.on_event('startup')
+def _service_startup():
+    _get_service_batcher().encode('warm up')
+@service_app.post('/encode')
+async def encode(payload: EncodeIn):
+    batcher = _get_service_batcher()
+    futures = [asyncio.wrap_future(batcher.submit(t)) for t in payload.texts]
+    return {'embeddings': await asyncio.gather(*futures)}
+@service_app.get('/stats')
+def stats():
+    return _get_service_batcher().stats()
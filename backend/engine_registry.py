@@ -0,0 +1,62 @@
+import os
+import time
+import hashlib
+import threading
+from typing import Optional
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+POOL_SIZE = int(os.environ.get('TARGET_POOL_SIZE', '5'))
+MAX_OVERFLOW = int(os.environ.get('TARGET_POOL_MAX_OVERFLOW', '5'))
+POOL_TIMEOUT = int(os.environ.get('TARGET_POOL_TIMEOUT', '30'))
+POOL_RECYCLE = int(os.environ.get('TARGET_POOL_RECYCLE', '1800'))
+ENGINE_IDLE_SECONDS = int(os.environ.get('TARGET_ENGINE_IDLE_SECONDS', '900'))
+MAX_ENGINES = int(os.environ.get('TARGET_MAX_ENGINES', '32'))
+_engines = {}
+_lock = threading.Lock()
+def _normalize_url(conn_str: str):
+    url = make_url(conn_str.strip())
+    return url.set(
+        drivername=url.drivername.lower(),
+        host=url.host.lower() if url.host else url.host,
+        query=dict(sorted(url.query.items())),
+    )
+def _fingerprint(url) -> str:
+    return hashlib.sha256(url.render_as_string(hide_password=False).encode('utf-8')).hexdigest()
+def connection_fingerprint(conn_str: str) -> str:
+    return _fingerprint(_normalize_url(conn_str))
+def dialect_name(conn_str: str) -> Optional[str]:
+    try:
+        return make_url(conn_str.strip()).get_backend_name()
+    except Exception:
+        return None
+def _build_engine(url):
+    kwargs = {'pool_pre_ping': True}
+    if url.get_backend_name() != 'sqlite':
+        kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT, pool_recycle=POOL_RECYCLE)
+    return create_engine(url, **kwargs)
+def _evict(now: float, keep: str):
+    stale = [fp for fp, (_, last_used) in _engines.items() if fp != keep and now - last_used > ENGINE_IDLE_SECONDS]
+    if keep not in _engines and len(_engines) - len(stale) >= MAX_ENGINES:
+        by_age = sorted((last_used, fp) for fp, (_, last_used) in _engines.items() if fp not in stale)
+        stale.extend(fp for _, fp in by_age[:len(_engines) - len(stale) - MAX_ENGINES + 1])
+    for fp in stale:
+        engine, _ = _engines.pop(fp)
+        engine.dispose()
+def get_engine(conn_str: str):
+    url = _normalize_url(conn_str)
+    fp = _fingerprint(url)
+    now = time.monotonic()
+    with _lock:
+        _evict(now, keep=fp)
+        item = _engines.get(fp)
+        if item is None:
+            engine = _build_engine(url)
+        else:
+            engine = item[0]
+        _engines[fp] = (engine, now)
+        return engine
+def dispose_all():
+    with _lock:
+        for engine, _ in _engines.values():
+            engine.dispose()
+        _engines.clear()
@@ -1,31 +1,94 @@
-from sqlalchemy import create_engine, text
+import io
+import os
+import csv
+import json
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 import pandas as pd
-from typing import Tuple
-import sqlparse
-from utils import is_destructive
-def validate_sql(sql: str) -> Tuple[bool, str]:
-    try:
-        parsed = sqlparse.parse(sql)
-        if not parsed:
-            return False, 'No valid SQL detected'
-        if is_destructive(sql):
-            return False, 'Destructive SQL statements are disallowed.'
-        return True, ''
-    except Exception as e:
-        return False, str(e)
-def execute_sql(conn_str: str, sql: str, limit: int = 1000) -> Tuple[pd.DataFrame, str]:
-    valid, msg = validate_sql(sql)
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Iterator, List, Optional, Tuple
+from sql_safety import analyze_sql, apply_row_limit
+from query_control import tracked_connection
+from engine_registry import dialect_name
+from metrics import timed, ROWS_RETURNED
+STREAM_BATCH_ROWS = int(os.environ.get('STREAM_BATCH_ROWS', '1000'))
+STREAM_ROW_LIMIT = int(os.environ.get('STREAM_ROW_LIMIT', '100000'))
+def validate_sql(sql: str, dialect: Optional[str] = None) -> Tuple[bool, str]:
+    analysis = analyze_sql(sql, dialect)
+    if analysis.error:
+        return False, analysis.error
+    return True, ''
+@timed('sql_validate')
+def prepare_sql(sql: str, limit: int = 1000, dialect: Optional[str] = None) -> str:
+    valid, msg = validate_sql(sql, dialect)
     if not valid:
         raise ValueError(f'SQL Validation failed: {msg}')
-    engine = create_engine(conn_str)
-    sql_to_run = sql
-    if 'LIMIT' not in sql.upper() and sql.strip().upper().startswith('SELECT'):
-        sql_to_run = sql.rstrip(';') + f' LIMIT {limit};'
+    return apply_row_limit(sql, limit, dialect)
+def execute_sql(conn_str: str, sql: str, limit: int = 1000, query_id: str = None, user_id: int = None, role: str = None) -> Tuple[pd.DataFrame, str]:
+    sql_to_run = prepare_sql(sql, limit, dialect_name(conn_str))
     try:
-        with engine.connect() as conn:
-            res = conn.execute(text(sql_to_run))
-            df = pd.DataFrame(res.fetchall(), columns=res.keys())
+        with tracked_connection(conn_str, query_id=query_id, user_id=user_id, role=role) as conn:
+            with timed('sql_execute'):
+                res = conn.execute(text(sql_to_run))
+                df = pd.DataFrame(res.fetchall(), columns=res.keys())
+            ROWS_RETURNED.inc(len(df))
             return df, sql_to_run
     except SQLAlchemyError as e:
         raise
+def iter_sql_batches(conn_str: str, sql_to_run: str, batch_rows: int = STREAM_BATCH_ROWS, query_id: str = None, user_id: int = None, role: str = None) -> Iterator[Tuple[List[str], list]]:
+    with tracked_connection(conn_str, query_id=query_id, user_id=user_id, role=role) as conn:
+        with timed('sql_execute'):
+            res = conn.execution_options(stream_results=True, yield_per=batch_rows).execute(text(sql_to_run))
+        columns = list(res.keys())
+        empty = True
+        for batch in res.partitions(batch_rows):
+            empty = False
+            ROWS_RETURNED.inc(len(batch))
+            yield columns, batch
+        if empty:
+            yield columns, []
+def stream_ndjson(conn_str: str, sql_to_run: str, query_id: str = None, user_id: int = None, role: str = None) -> Iterator[str]:
+    for columns, rows in iter_sql_batches(conn_str, sql_to_run, query_id=query_id, user_id=user_id, role=role):
+        if rows:
+            yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows)
+def stream_csv(conn_str: str, sql_to_run: str, query_id: str = None, user_id: int = None, role: str = None) -> Iterator[str]:
+    header_sent = False
+    for columns, rows in iter_sql_batches(conn_str, sql_to_run, query_id=query_id, user_id=user_id, role=role):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if not header_sent:
+            writer.writerow(columns)
+            header_sent = True
+        writer.writerows(rows)
+        yield buf.getvalue()
+def _column_array(values) -> pa.Array:
+    try:
+        arr = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    if pa.types.is_decimal(arr.type):
+        arr = arr.cast(pa.decimal128(38, arr.type.scale))
+    return arr
+def _combine_chunks(chunks: List[pa.Array]) -> pa.ChunkedArray:
+    types = {c.type for c in chunks if not pa.types.is_null(c.type)}
+    target = types.pop() if len(types) == 1 else (pa.string() if types else pa.null())
+    return pa.chunked_array([c if c.type == target else c.cast(target) for c in chunks], type=target)
+@timed('arrow_build')
+def execute_arrow(conn_str: str, sql_to_run: str, query_id: str = None, user_id: int = None, role: str = None) -> pa.Table:
+    columns, chunks = [], []
+    for columns, rows in iter_sql_batches(conn_str, sql_to_run, query_id=query_id, user_id=user_id, role=role):
+        if not chunks:
+            chunks = [[] for _ in columns]
+        for i, values in enumerate(zip(*rows)):
+            chunks[i].append(_column_array(values))
+    return pa.table([_combine_chunks(c) for c in chunks], names=columns)
+def table_to_ipc(table: pa.Table) -> bytes:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+def table_to_parquet(table: pa.Table) -> bytes:
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression='zstd')
+    return sink.getvalue().to_pybytes()
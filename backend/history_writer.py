@@ -0,0 +1,121 @@
+import os
+import time
+import queue
+import logging
+import threading
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from db import SessionLocal, engine
+from metrics import timed, HISTORY_DROPPED
+HISTORY_BATCH_SIZE = int(os.environ.get('HISTORY_BATCH_SIZE', '200'))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', '0.05'))
+HISTORY_ID_BLOCK = int(os.environ.get('HISTORY_ID_BLOCK', '100'))
+HISTORY_FLUSH_RETRIES = 3
+HISTORY_FLUSH_TIMEOUT = float(os.environ.get('HISTORY_FLUSH_TIMEOUT', '2'))
+logger = logging.getLogger(__name__)
+_STOP = object()
+class WriteBehindQueue:
+    def __init__(self, batch_size: int = HISTORY_BATCH_SIZE, flush_interval: float = HISTORY_FLUSH_INTERVAL, id_block: int = HISTORY_ID_BLOCK):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.id_block = id_block
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._next_id = 0
+        self._block_end = 0
+        self._progress = threading.Condition()
+        self._submitted = 0
+        self._processed = 0
+    def _reserve_block(self):
+        params = {'name': 'query_history', 'n': self.id_block}
+        with engine.begin() as conn:
+            conn.execute(text('INSERT OR IGNORE INTO id_allocator (name, next_id) SELECT :name, COALESCE(MAX(id), 0) + 1 FROM query_history'), params)
+            end = conn.execute(text('UPDATE id_allocator SET next_id = next_id + :n WHERE name = :name RETURNING next_id'), params).scalar_one()
+        self._next_id, self._block_end = end - self.id_block, end
+    def next_history_id(self) -> int:
+        with self._id_lock:
+            if self._next_id >= self._block_end:
+                self._reserve_block()
+            value = self._next_id
+            self._next_id += 1
+            return value
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+                self._thread.start()
+    def submit(self, *objs):
+        self.start()
+        with self._progress:
+            self._submitted += len(objs)
+            for obj in objs:
+                self._queue.put(obj)
+    def _mark_processed(self, n: int):
+        with self._progress:
+            self._processed += n
+            self._progress.notify_all()
+    @timed('history_commit')
+    def _write(self, batch: list):
+        for attempt in range(HISTORY_FLUSH_RETRIES):
+            db = SessionLocal()
+            try:
+                db.add_all(batch)
+                db.commit()
+                return
+            except OperationalError:
+                db.rollback()
+                time.sleep(0.1 * (attempt + 1))
+            except Exception:
+                db.rollback()
+                if len(batch) > 1:
+                    db.close()
+                    for obj in batch:
+                        self._write([obj])
+                    return
+                logger.exception('Dropping %d history rows after write failure', len(batch))
+                HISTORY_DROPPED.inc(len(batch))
+                return
+            finally:
+                db.close()
+        logger.error('Dropping %d history rows after %d retries', len(batch), HISTORY_FLUSH_RETRIES)
+        HISTORY_DROPPED.inc(len(batch))
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    self._queue.task_done()
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+                self._mark_processed(len(batch))
+                for _ in batch:
+                    self._queue.task_done()
+    def flush(self, timeout: float = HISTORY_FLUSH_TIMEOUT) -> bool:
+        with self._progress:
+            target = self._submitted
+            return self._progress.wait_for(lambda: self._processed >= target, timeout)
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    self._write([item])
+                    self._mark_processed(1)
+                self._queue.task_done()
+history_writer = WriteBehindQueue()
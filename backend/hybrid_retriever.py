@@ -0,0 +1,134 @@
+import os
+import math
+import time
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+from cache import TTLCache
+from metrics import timed, cache_event
+from utils import tokenize
+from join_graph import get_join_graph
+from vector_indexer import cache_stats as vector_cache_stats, get_documents, get_entries, get_index_version, normalize_query, semantic_search, vector_query, INDEX_COLUMNS, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'hybrid')
+RRF_K = int(os.environ.get('RRF_K', '60'))
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', '4'))
+COLUMN_WEIGHT = float(os.environ.get('HYBRID_COLUMN_WEIGHT', '0.7'))
+LEXICAL_REBUILD_SECONDS = float(os.environ.get('LEXICAL_REBUILD_SECONDS', '5'))
+BM25_K1 = 1.2
+BM25_B = 0.75
+class LexicalIndex:
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[Dict]):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.postings = defaultdict(list)
+        self.doc_len = []
+        for i, doc in enumerate(documents):
+            terms = Counter(tokenize(doc))
+            self.doc_len.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings[term].append((i, tf))
+        self.avg_len = (sum(self.doc_len) / len(self.doc_len)) if self.doc_len else 0.0
+        n = len(documents)
+        self.idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in self.postings.items()}
+        self.by_id = {_id: i for i, _id in enumerate(ids)}
+    def search(self, query: str, n: int) -> List[Tuple[int, float]]:
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[i] / (self.avg_len or 1.0))
+                scores[i] += idf * tf * (BM25_K1 + 1) / norm
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:n]
+_lexical = {}
+_lexical_builds = {}
+_lexical_lock = threading.Lock()
+_hybrid_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+def _lexical_indexes(schema: str, version: int) -> Tuple[int, LexicalIndex, LexicalIndex]:
+    with _lexical_lock:
+        cached = _lexical.get(schema)
+        build = _lexical_builds.setdefault(schema, threading.Lock())
+    if cached is not None and (cached[0] == version or time.monotonic() - cached[3] < LEXICAL_REBUILD_SECONDS):
+        return cached[:3]
+    if not build.acquire(blocking=cached is None):
+        return cached[:3]
+    try:
+        with _lexical_lock:
+            cached = _lexical.get(schema)
+        if cached is not None and cached[0] == version:
+            return cached[:3]
+        tables = LexicalIndex(*get_documents(schema))
+        columns = LexicalIndex(*get_documents(schema, columns=True)) if INDEX_COLUMNS else LexicalIndex([], [], [])
+        with _lexical_lock:
+            _lexical[schema] = (version, tables, columns, time.monotonic())
+        return version, tables, columns
+    finally:
+        build.release()
+def cache_stats() -> Dict[str, dict]:
+    with _lexical_lock:
+        lexical = {schema: {'version': v, 'tables': len(t.ids), 'columns': len(c.ids)} for schema, (v, t, c, _) in _lexical.items()}
+    return {**vector_cache_stats(), 'hybrid_search': _hybrid_cache.stats(), 'lexical_indexes': lexical}
+def hybrid_search(schema: str, query: str, k: int = 5) -> List[Dict]:
+    version = get_index_version(schema)
+    key = (schema, normalize_query(query), k, version)
+    cached = _hybrid_cache.get(key)
+    cache_event('hybrid_search', cached is not None)
+    if cached is not None:
+        return [dict(r) for r in cached]
+    with timed('lexical_index'):
+        lexical_version, tables, columns = _lexical_indexes(schema, version)
+    n = k * HYBRID_CANDIDATES
+    scores = defaultdict(float)
+    distances = {}
+    matched = defaultdict(list)
+    def add(table_id: str, rank: int, weight: float):
+        scores[table_id] += weight / (RRF_K + rank + 1)
+    for rank, hit in enumerate(vector_query(schema, query, n)):
+        add(hit['id'], rank, 1.0)
+        distances[hit['id']] = hit['distance']
+    for rank, (i, _) in enumerate(tables.search(query, n)):
+        add(tables.ids[i], rank, 1.0)
+    if INDEX_COLUMNS:
+        column_hits = [(h['metadata'].get('table_id'), h['metadata'].get('name')) for h in vector_query(schema, query, n, columns=True)]
+        for rank, (table_id, name) in enumerate(column_hits):
+            add(table_id, rank, COLUMN_WEIGHT)
+        lexical_hits = [(columns.metadatas[i].get('table_id'), columns.metadatas[i].get('name')) for i, _ in columns.search(query, n)]
+        for rank, (table_id, name) in enumerate(lexical_hits):
+            add(table_id, rank, COLUMN_WEIGHT)
+        for table_id, name in column_hits + lexical_hits:
+            if name not in matched[table_id]:
+                matched[table_id].append(name)
+    out = []
+    for table_id, score in sorted(scores.items(), key=lambda kv: kv[1], reverse=True):
+        i = tables.by_id.get(table_id)
+        if i is None:
+            continue
+        out.append({'id': table_id, 'document': tables.documents[i], 'metadata': tables.metadatas[i], 'distance': distances.get(table_id), 'score': score, 'matched_columns': matched.get(table_id, [])})
+        if len(out) >= k:
+            break
+    if lexical_version == version:
+        _hybrid_cache.set(key, out)
+    return [dict(r) for r in out]
+def add_join_context(schema: str, results: List[Dict]) -> List[Dict]:
+    graph = get_join_graph(schema)
+    if graph is None or len(results) < 2:
+        return results
+    bridges, conditions = graph.expand([r['id'] for r in results])
+    if not conditions:
+        return results
+    extra = get_entries(schema, bridges)
+    for r in extra:
+        r['bridge'] = True
+    out = results + extra
+    for r in out:
+        r['joins'] = [cond for a, b, cond in conditions if r['id'] in (a, b)]
+    return out
+@timed('retrieve')
+def retrieve_context(schema: str, query: str, k: int = 5) -> List[Dict]:
+    if RETRIEVAL_MODE == 'hybrid':
+        results = hybrid_search(schema, query, k)
+    else:
+        results = semantic_search(schema, query, k)
+    return add_join_context(schema, results)
@@ -0,0 +1,213 @@
+import os
+import json
+import uuid
+import queue
+import socket
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from db import SessionLocal
+from models import ExtractionJob
+from connectors.factory import get_connector
+from engine_registry import connection_fingerprint
+from join_graph import build_join_graph
+from vector_indexer import upsert_metadata_embeddings, prune_missing
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', '4'))
+EXTRACT_BATCH_SIZE = int(os.environ.get('EXTRACT_BATCH_SIZE', '500'))
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', '10'))
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', '60'))
+ACTIVE_STATUSES = ('queued', 'running')
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+_executor = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix='extract')
+_cancel_events = {}
+_job_locks = {}
+_schema_locks = {}
+_registry_lock = threading.Lock()
+_heartbeat_stop = threading.Event()
+_heartbeat_thread = None
+_DONE = object()
+class JobCancelled(Exception):
+    pass
+def job_key(conn_str: str, db_type: str, schemas: List[str]) -> str:
+    raw = '|'.join([connection_fingerprint(conn_str), (db_type or '').lower()] + sorted(set(schemas)))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+def job_to_dict(job: ExtractionJob) -> Dict:
+    return {'job_id': job.id, 'status': job.status, 'db_type': job.db_type, 'schemas': json.loads(job.schemas), 'progress': json.loads(job.progress or '{}'), 'error': job.error, 'created_at': job.created_at.isoformat() if job.created_at else None, 'updated_at': job.updated_at.isoformat() if job.updated_at else None}
+def _update_schema_progress(job_id: str, schema: str, **fields):
+    with _registry_lock:
+        lock = _job_locks.setdefault(job_id, threading.Lock())
+    with lock:
+        db = SessionLocal()
+        try:
+            job = db.get(ExtractionJob, job_id)
+            progress = json.loads(job.progress or '{}')
+            progress.setdefault(schema, {}).update(fields)
+            job.progress = json.dumps(progress)
+            states = [p.get('status') for p in progress.values()]
+            if any(s in ACTIVE_STATUSES for s in states):
+                job.status = 'running'
+            elif 'failed' in states:
+                job.status = 'failed'
+                job.error = '; '.join(f"{k}: {v['error']}" for k, v in progress.items() if v.get('error'))
+            elif 'cancelled' in states:
+                job.status = 'cancelled'
+            else:
+                job.status = 'succeeded'
+            db.commit()
+            if job.status not in ACTIVE_STATUSES:
+                with _registry_lock:
+                    _cancel_events.pop(job_id, None)
+                    _job_locks.pop(job_id, None)
+        finally:
+            db.close()
+def _put(out: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
+def _produce_batches(connector, out: queue.Queue, stop: threading.Event):
+    try:
+        batch = []
+        for entry in connector.iter_metadata():
+            batch.append(entry)
+            if len(batch) >= EXTRACT_BATCH_SIZE:
+                if not _put(out, batch, stop):
+                    return
+                batch = []
+        if batch and not _put(out, batch, stop):
+            return
+        _put(out, _DONE, stop)
+    except Exception as e:
+        _put(out, e, stop)
+def _run_schema(job_id: str, conn_str: str, db_type: str, schema: str, cancel: threading.Event):
+    with _registry_lock:
+        lock = _schema_locks.setdefault(schema, threading.Lock())
+    with lock:
+        _index_schema(job_id, conn_str, db_type, schema, cancel)
+def _index_schema(job_id: str, conn_str: str, db_type: str, schema: str, cancel: threading.Event):
+    stop = threading.Event()
+    try:
+        if cancel.is_set():
+            raise JobCancelled()
+        _update_schema_progress(job_id, schema, status='running')
+        connector = get_connector(db_type, conn_str, schema)
+        connector.connect()
+        batches = queue.Queue(maxsize=2)
+        producer = threading.Thread(target=_produce_batches, args=(connector, batches, stop), name=f'extract-{schema}', daemon=True)
+        producer.start()
+        graph_entries, seen = [], set()
+        totals = {'added': 0, 'changed': 0, 'removed': 0, 'skipped': 0}
+        while True:
+            item = batches.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if cancel.is_set():
+                raise JobCancelled()
+            stats = upsert_metadata_embeddings(schema, item, prune=False)
+            for k, v in stats.items():
+                totals[k] += v
+            seen.update(e['id'] for e in item)
+            graph_entries.extend({'id': e['id'], 'schema': e['schema'], 'foreign_keys': e.get('foreign_keys') or []} for e in item)
+            _update_schema_progress(job_id, schema, extracted=len(seen), **totals)
+        if cancel.is_set():
+            raise JobCancelled()
+        totals['removed'] = prune_missing(schema, seen)
+        build_join_graph(schema, graph_entries)
+        _update_schema_progress(job_id, schema, status='succeeded', extracted=len(seen), **totals)
+    except JobCancelled:
+        _update_schema_progress(job_id, schema, status='cancelled')
+    except Exception as e:
+        _update_schema_progress(job_id, schema, status='failed', error=str(e))
+    finally:
+        stop.set()
+def submit_job(db: Session, conn_str: str, db_type: str, schemas: List[str], user_id: Optional[int] = None) -> Tuple[ExtractionJob, bool]:
+    schemas = list(dict.fromkeys(schemas))
+    key = job_key(conn_str, db_type, schemas)
+    active = db.query(ExtractionJob).filter(ExtractionJob.dedupe_key == key, ExtractionJob.status.in_(ACTIVE_STATUSES))
+    existing = active.first()
+    if existing is not None:
+        return existing, False
+    job = ExtractionJob(id=uuid.uuid4().hex, dedupe_key=key, status='queued', db_type=db_type, schemas=json.dumps(schemas), progress=json.dumps({s: {'status': 'queued'} for s in schemas}), user_id=user_id, owner=WORKER_ID, heartbeat_at=datetime.utcnow())
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        existing = active.first()
+        if existing is None:
+            raise
+        return existing, False
+    cancel = threading.Event()
+    with _registry_lock:
+        _cancel_events[job.id] = cancel
+    for schema in schemas:
+        _executor.submit(_run_schema, job.id, conn_str, db_type, schema, cancel)
+    return job, True
+def _cancel_local(job_id: str) -> bool:
+    with _registry_lock:
+        cancel = _cancel_events.get(job_id)
+    if cancel is None:
+        return False
+    cancel.set()
+    return True
+def cancel_job(db: Session, job: ExtractionJob) -> bool:
+    if job.status not in ACTIVE_STATUSES:
+        return False
+    if not _cancel_local(job.id):
+        job.cancel_requested = True
+        db.commit()
+    return True
+def fail_interrupted_jobs(db: Optional[Session] = None) -> int:
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        stale = (ExtractionJob.owner.is_(None)) | ((ExtractionJob.owner != WORKER_ID) & ((ExtractionJob.heartbeat_at.is_(None)) | (ExtractionJob.heartbeat_at < cutoff)))
+        n = db.query(ExtractionJob).filter(ExtractionJob.status.in_(ACTIVE_STATUSES), stale).update({'status': 'failed', 'error': 'Interrupted: the worker running this job stopped'}, synchronize_session=False)
+        db.commit()
+        return n
+    finally:
+        if own:
+            db.close()
+def _heartbeat():
+    with _registry_lock:
+        owned = list(_cancel_events)
+    db = SessionLocal()
+    try:
+        if owned:
+            db.query(ExtractionJob).filter(ExtractionJob.id.in_(owned)).update({'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            for (job_id,) in db.query(ExtractionJob.id).filter(ExtractionJob.id.in_(owned), ExtractionJob.cancel_requested.is_(True)).all():
+                _cancel_local(job_id)
+        fail_interrupted_jobs(db)
+    finally:
+        db.close()
+def _heartbeat_loop():
+    while not _heartbeat_stop.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            _heartbeat()
+        except Exception:
+            pass
+def start_job_monitor():
+    global _heartbeat_thread
+    fail_interrupted_jobs()
+    if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+        _heartbeat_stop.clear()
+        _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name='extract-job-heartbeat', daemon=True)
+        _heartbeat_thread.start()
+def shutdown_jobs():
+    _heartbeat_stop.set()
+    with _registry_lock:
+        events = list(_cancel_events.values())
+    for cancel in events:
+        cancel.set()
+    _executor.shutdown(wait=False, cancel_futures=True)
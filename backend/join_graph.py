@@ -0,0 +1,131 @@
+import os
+import json
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils import sanitize_identifier
+JOIN_GRAPH_DIR = os.environ.get('JOIN_GRAPH_DIR', '/data/join_graphs')
+MAX_JOIN_HOPS = int(os.environ.get('MAX_JOIN_HOPS', '3'))
+MAX_BRIDGE_TABLES = int(os.environ.get('MAX_BRIDGE_TABLES', '4'))
+_graphs = {}
+_graphs_lock = threading.Lock()
+class JoinGraph:
+    def __init__(self, edges: Dict[str, Dict[str, List[str]]], max_hops: int = MAX_JOIN_HOPS):
+        self.edges = edges
+        self.max_hops = max_hops
+    @classmethod
+    def build(cls, entries: List[Dict], max_hops: int = MAX_JOIN_HOPS) -> 'JoinGraph':
+        edges = {}
+        for e in entries:
+            src = e['id']
+            for fk in e.get('foreign_keys') or []:
+                dst = f"{fk.get('referred_schema') or e['schema']}.{fk['referred_table']}"
+                if dst == src:
+                    continue
+                cond = ' AND '.join(f"{src}.{c} = {dst}.{r}" for c, r in zip(fk.get('constrained_columns') or [], fk.get('referred_columns') or []))
+                if not cond:
+                    continue
+                for a, b in ((src, dst), (dst, src)):
+                    conds = edges.setdefault(a, {}).setdefault(b, [])
+                    if cond not in conds:
+                        conds.append(cond)
+        return cls(edges, max_hops)
+    def _step(self, frontier: List[str], seen: Dict[str, Optional[str]], other: Dict[str, Optional[str]]) -> Tuple[List[str], Optional[str]]:
+        nxt = []
+        for node in frontier:
+            for neighbour in self.edges.get(node, {}):
+                if neighbour in seen:
+                    continue
+                seen[neighbour] = node
+                if neighbour in other:
+                    return nxt, neighbour
+                nxt.append(neighbour)
+        return nxt, None
+    def shortest_path(self, sources: Iterable[str], dst: str) -> Optional[List[str]]:
+        sources = [s for s in sources if s in self.edges]
+        if dst in sources:
+            return [dst]
+        if not sources or dst not in self.edges:
+            return None
+        fwd, bwd = dict.fromkeys(sources), {dst: None}
+        fwd_frontier, bwd_frontier = list(sources), [dst]
+        meet = None
+        for _ in range(self.max_hops):
+            if not fwd_frontier or not bwd_frontier:
+                return None
+            if len(fwd_frontier) <= len(bwd_frontier):
+                fwd_frontier, meet = self._step(fwd_frontier, fwd, bwd)
+            else:
+                bwd_frontier, meet = self._step(bwd_frontier, bwd, fwd)
+            if meet is not None:
+                break
+        if meet is None:
+            return None
+        out = [meet]
+        while fwd[out[-1]] is not None:
+            out.append(fwd[out[-1]])
+        out.reverse()
+        node = bwd[meet]
+        while node is not None:
+            out.append(node)
+            node = bwd[node]
+        return out
+    def path(self, src: str, dst: str) -> Optional[List[str]]:
+        if src == dst:
+            return [src]
+        return self.shortest_path([src], dst)
+    def join_condition(self, a: str, b: str) -> Optional[str]:
+        conds = self.edges.get(a, {}).get(b)
+        return conds[0] if conds else None
+    def expand(self, table_ids: List[str], max_bridges: int = MAX_BRIDGE_TABLES) -> Tuple[List[str], List[Tuple[str, str, str]]]:
+        nodes = [t for t in table_ids if t in self.edges]
+        if len(nodes) < 2:
+            return [], []
+        connected = [nodes[0]]
+        bridges, conditions = [], []
+        for target in nodes[1:]:
+            if target in connected:
+                continue
+            best = self.shortest_path(connected, target)
+            if best is None:
+                continue
+            new_bridges = [n for n in best[1:-1] if n not in connected and n not in table_ids]
+            if len(bridges) + len(new_bridges) > max_bridges:
+                continue
+            bridges.extend(new_bridges)
+            for a, b in zip(best, best[1:]):
+                cond = self.join_condition(a, b)
+                if cond and all(c != cond for _, _, c in conditions):
+                    conditions.append((a, b, cond))
+            connected.extend(n for n in best[1:] if n not in connected)
+        return bridges, conditions
+    def to_dict(self) -> Dict:
+        return {'edges': self.edges}
+def _graph_path(schema: str) -> str:
+    return os.path.join(JOIN_GRAPH_DIR, f'{sanitize_identifier(schema)}.json')
+def build_join_graph(schema: str, entries: List[Dict]) -> JoinGraph:
+    graph = JoinGraph.build(entries)
+    os.makedirs(JOIN_GRAPH_DIR, exist_ok=True)
+    path = _graph_path(schema)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(graph.to_dict(), f)
+    os.replace(tmp, path)
+    with _graphs_lock:
+        _graphs[schema] = (os.path.getmtime(path), graph)
+    return graph
+def get_join_graph(schema: str) -> Optional[JoinGraph]:
+    path = _graph_path(schema)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _graphs_lock:
+        cached = _graphs.get(schema)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    with open(path) as f:
+        data = json.load(f)
+    graph = JoinGraph(data['edges'])
+    with _graphs_lock:
+        _graphs[schema] = (mtime, graph)
+    return graph
@@ -0,0 +1,116 @@
+import os
+import math
+import time
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Hashable, Optional
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '2'))
+LLM_MODEL_CONCURRENCY = os.environ.get('LLM_MODEL_CONCURRENCY', '')
+LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', '32'))
+LLM_DEADLINE_SECONDS = float(os.environ.get('LLM_DEADLINE_SECONDS', '120'))
+PRIORITIES = {'interactive': 0, 'batch': 1}
+class QueueFullError(Exception):
+    def __init__(self, model: str, retry_after: int):
+        super().__init__(f'Generation queue for {model} is full, retry in {retry_after}s')
+        self.retry_after = retry_after
+class DeadlineExceededError(Exception):
+    pass
+def _parse_model_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for part in spec.split(','):
+        if '=' in part:
+            name, value = part.rsplit('=', 1)
+            limits[name.strip()] = int(value)
+    return limits
+class _ModelQueue:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiting = []
+        self.avg_seconds = 5.0
+        self.cond = threading.Condition()
+class GenerationScheduler:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE, model_limits: Optional[Dict[str, int]] = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.model_limits = model_limits or {}
+        self._queues = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+    def _queue(self, model: str) -> _ModelQueue:
+        with self._lock:
+            q = self._queues.get(model)
+            if q is None:
+                q = self._queues[model] = _ModelQueue(self.model_limits.get(model, self.max_concurrency))
+            return q
+    def _retry_after(self, q: _ModelQueue) -> int:
+        return max(1, math.ceil(q.avg_seconds * (len(q.waiting) + 1) / q.limit))
+    def acquire(self, model: str, priority: str = 'interactive', deadline: Optional[float] = None):
+        q = self._queue(model)
+        with q.cond:
+            if q.active < q.limit and not q.waiting:
+                q.active += 1
+                return
+            if len(q.waiting) >= self.max_queue:
+                raise QueueFullError(model, self._retry_after(q))
+            ticket = (PRIORITIES.get(priority, len(PRIORITIES)), next(self._seq))
+            heapq.heappush(q.waiting, ticket)
+            try:
+                while not (q.active < q.limit and q.waiting[0] == ticket):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise DeadlineExceededError(f'Deadline exceeded while queued for {model}')
+                    q.cond.wait(remaining)
+                heapq.heappop(q.waiting)
+                q.active += 1
+            except BaseException:
+                if ticket in q.waiting:
+                    q.waiting.remove(ticket)
+                    heapq.heapify(q.waiting)
+                raise
+            finally:
+                q.cond.notify_all()
+    def release(self, model: str, elapsed: Optional[float] = None):
+        q = self._queue(model)
+        with q.cond:
+            q.active -= 1
+            if elapsed is not None:
+                q.avg_seconds = 0.8 * q.avg_seconds + 0.2 * elapsed
+            q.cond.notify_all()
+    def run(self, model: str, key: Hashable, fn: Callable[..., object], priority: str = 'interactive', timeout: Optional[float] = None):
+        deadline = time.monotonic() + (timeout or LLM_DEADLINE_SECONDS)
+        flight = (model, key)
+        with self._lock:
+            fut = self._inflight.get(flight)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[flight] = Future()
+        if not leader:
+            try:
+                return fut.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                raise DeadlineExceededError(f'Deadline exceeded waiting for an identical {model} generation')
+        try:
+            self.acquire(model, priority, deadline)
+            started = time.monotonic()
+            try:
+                result = fn(timeout=max(1.0, deadline - started))
+            finally:
+                self.release(model, time.monotonic() - started)
+            fut.set_result(result)
+            return result
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(flight, None)
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            queues = dict(self._queues)
+            inflight = len(self._inflight)
+        return {'inflight_prompts': inflight, 'models': {m: {'limit': q.limit, 'active': q.active, 'queued': len(q.waiting), 'avg_seconds': round(q.avg_seconds, 3)} for m, q in queues.items()}}
+scheduler = GenerationScheduler(model_limits=_parse_model_limits(LLM_MODEL_CONCURRENCY))
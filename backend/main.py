@@ -1,35 +1,105 @@
 import os
+import json
+import pyarrow as pa
+from datetime import datetime
 from fastapi import FastAPI, HTTPException, Depends, Request
-from pydantic import BaseModel
-from typing import List
+from fastapi.responses import StreamingResponse, Response, JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from metadata_extractor import extract_schema_metadata
-from vector_indexer import upsert_metadata_embeddings, semantic_search
-from sql_generator import generate_sql_from_context
-from executor import execute_sql
-from utils import sanitize_identifier
-from db import init_db, SessionLocal
-from models import User, QueryHistory
-from auth import authenticate_user, create_access_token, get_current_user, get_db, get_password_hash, require_role, blacklist_token
+from vector_indexer import upsert_metadata_embeddings, embed_query, get_index_version, warm_up
+from hybrid_retriever import retrieve_context, cache_stats
+from join_graph import build_join_graph
+from sql_generator import generate_sql_from_prompt, build_prompt_with_stats, stream_ollama_generate, clean_sql_output, close_clients, OLLAMA_MODEL
+import sql_cache
+import time
+import threading
+from llm_scheduler import scheduler, QueueFullError, DeadlineExceededError, LLM_DEADLINE_SECONDS
+from cost_guard import preflight, plan_query, CostLimitError
+from result_cache import result_cache
+from sql_safety import normalize_sql
+from query_control import admission, registry, admitted, AdmissionSlot, new_query_id, AdmissionError, QueryCancelledError, QueryTimeoutError, QueryIdInUseError
+from metrics import timed, cache_event, render_metrics, ServerTimingMiddleware
+from executor import execute_sql, prepare_sql, stream_ndjson, stream_csv, execute_arrow, table_to_ipc, table_to_parquet, STREAM_ROW_LIMIT
+from utils import sanitize_identifier, encode_cursor, decode_cursor, fts_match_expression
+from db import init_db, SessionLocal, history_fts_available
+from models import User, QueryHistory, ExtractionJob
+from auth import authenticate_user, create_access_token, get_current_user, get_db, get_password_hash, require_role, blacklist_token, invalidate_user, start_blacklist_purger, stop_blacklist_purger
 from connectors.factory import get_connector
+from engine_registry import get_engine, dispose_all, connection_fingerprint, dialect_name
+from history_writer import history_writer
+import jobs
 from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
-init_db()
+from sqlalchemy import text, tuple_
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '50'))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', '500'))
 app = FastAPI(title='AI Metadata-to-SQL Generator')
+app.add_middleware(ServerTimingMiddleware)
+_warmup = {'state': 'pending', 'seconds': None, 'error': None}
+def _run_warmup():
+    _warmup['state'] = 'warming'
+    try:
+        _warmup['seconds'] = round(warm_up(), 3)
+        _warmup['state'] = 'ready'
+    except Exception as e:
+        _warmup['state'], _warmup['error'] = 'failed', str(e)
+@app.on_event('startup')
+def startup():
+    init_db()
+    jobs.start_job_monitor()
+    threading.Thread(target=_run_warmup, name='model-warmup', daemon=True).start()
+    start_blacklist_purger()
+    history_writer.start()
+    registry.start()
+@app.on_event('shutdown')
+async def shutdown():
+    stop_blacklist_purger()
+    jobs.shutdown_jobs()
+    history_writer.stop()
+    registry.stop()
+    dispose_all()
+    await close_clients()
 class ConnectIn(BaseModel):
     conn_str: str
-class ExtractIn(BaseModel):
+class SchemaModel(BaseModel):
+    db_schema: str = Field('public', alias='schema')
+    class Config:
+        allow_population_by_field_name = True
+class ExtractIn(SchemaModel):
+    conn_str: str
+    db_type: str = 'postgresql'
+class ExtractJobIn(BaseModel):
     conn_str: str
-    schema: str = 'public'
+    schemas: List[str] = ['public']
     db_type: str = 'postgresql'
-class QueryIn(BaseModel):
+class QueryIn(SchemaModel):
     conn_str: str
-    schema: str = 'public'
     question: str
     top_k: int = 6
     db_type: str = 'postgresql'
+    priority: str = 'interactive'
 class ExecIn(BaseModel):
     conn_str: str
     sql: str
+    format: str = 'json'
+    confirm: bool = False
+    no_cache: bool = False
+    query_id: Optional[str] = None
+class ExecStreamIn(ExecIn):
+    format: str = 'ndjson'
+COLUMNAR_FORMATS = {'arrow': (table_to_ipc, 'application/vnd.apache.arrow.stream'), 'parquet': (table_to_parquet, 'application/vnd.apache.parquet')}
+@app.get('/metrics')
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
+@app.get('/healthz')
+def healthz():
+    return {'status': 'ok'}
+@app.get('/readyz')
+def readyz():
+    return JSONResponse(status_code=200 if _warmup['state'] == 'ready' else 503, content={'ready': _warmup['state'] == 'ready', **_warmup})
 @app.post('/auth/token')
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = authenticate_user(db, form_data.username, form_data.password)
@@ -47,6 +117,7 @@ def create_user(username: str, password: str, role: str = 'analyst', current_use
     db.add(u)
     db.commit()
     db.refresh(u)
+    invalidate_user(u.username)
     return {'ok': True, 'username': u.username, 'role': u.role}
 @app.post('/auth/logout')
 def logout(request: Request, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -57,25 +128,15 @@ def logout(request: Request, current_user: User = Depends(get_current_user), db:
     if len(parts) != 2:
         raise HTTPException(status_code=400, detail='Invalid Authorization header')
     token = parts[1]
-    try:
-        import jwt
-        payload = jwt.decode(token, os.environ.get('APP_SECRET_KEY', 'change_this_secret'), algorithms=['HS256'])
-        exp = payload.get('exp')
-        expires_at = None
-        if exp:
-            from datetime import datetime
-            expires_at = datetime.utcfromtimestamp(exp)
-    except Exception:
-        expires_at = None
-    blacklist_token(db, token, expires_at)
+    blacklist_token(db, token)
     return {'ok': True, 'detail': 'Logged out'}
 @app.post('/connect')
 def connect(payload: ConnectIn, current_user: User = Depends(get_current_user)):
     try:
-        from sqlalchemy import create_engine
-        engine = create_engine(payload.conn_str)
+        from sqlalchemy import text
+        engine = get_engine(payload.conn_str)
         with engine.connect() as conn:
-            conn.execute('SELECT 1')
+            conn.execute(text('SELECT 1'))
         return {'ok': True}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -83,42 +144,268 @@ def connect(payload: ConnectIn, current_user: User = Depends(get_current_user)):
 def extract_metadata(payload: ExtractIn, current_user: User = Depends(get_current_user)):
     try:
         try:
-            connector = get_connector(payload.db_type, payload.conn_str, payload.schema)
+            connector = get_connector(payload.db_type, payload.conn_str, payload.db_schema)
         except Exception as ce:
             raise HTTPException(status_code=400, detail=str(ce))
         connector.connect()
         entries = connector.extract_metadata()
-        upsert_metadata_embeddings(payload.schema, entries)
-        return {'ok': True, 'count': len(entries)}
+        build_join_graph(payload.db_schema, entries)
+        stats = upsert_metadata_embeddings(payload.db_schema, entries)
+        return {'ok': True, 'count': len(entries), **stats}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+@app.post('/extract_jobs')
+def submit_extract_job(payload: ExtractJobIn, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    if not payload.schemas:
+        raise HTTPException(status_code=400, detail='At least one schema is required')
+    try:
+        get_connector(payload.db_type, payload.conn_str, payload.schemas[0])
+    except Exception as ce:
+        raise HTTPException(status_code=400, detail=str(ce))
+    job, created = jobs.submit_job(db, payload.conn_str, payload.db_type, payload.schemas, user_id=current_user.id)
+    if not created and job.user_id != current_user.id and current_user.role != 'admin':
+        raise HTTPException(status_code=409, detail='An extraction of these schemas is already running for another user')
+    return {**jobs.job_to_dict(job), 'deduplicated': not created}
+def _visible_job(db: Session, job_id: str, user: User) -> ExtractionJob:
+    job = db.get(ExtractionJob, job_id)
+    if job is None or (job.user_id != user.id and user.role != 'admin'):
+        raise HTTPException(status_code=404, detail='Job not found')
+    return job
+@app.get('/extract_jobs/{job_id}')
+def get_extract_job(job_id: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return jobs.job_to_dict(_visible_job(db, job_id, current_user))
+@app.delete('/extract_jobs/{job_id}')
+def cancel_extract_job(job_id: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    job = _visible_job(db, job_id, current_user)
+    if not jobs.cancel_job(db, job):
+        raise HTTPException(status_code=409, detail=f'Job is already {job.status}')
+    return {'ok': True, 'job_id': job_id, 'status': 'cancelling'}
 @app.post('/generate_sql')
 def generate_sql(payload: QueryIn, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     try:
-        results = semantic_search(payload.schema, payload.question, k=payload.top_k)
-        sql = generate_sql_from_context(results, payload.question)
-        q = QueryHistory(question=payload.question, sql=sql, schema=payload.schema, user_id=current_user.id)
-        db.add(q)
-        db.commit()
-        db.refresh(q)
-        return {'sql': sql, 'context': results, 'history_id': q.id}
+        results = retrieve_context(payload.db_schema, payload.question, k=payload.top_k)
+        version = get_index_version(payload.db_schema)
+        ctx_key = sql_cache.context_key(results)
+        q_emb = embed_query(payload.question)
+        hit = sql_cache.lookup(db, payload.db_schema, version, OLLAMA_MODEL, ctx_key, payload.question, q_emb)
+        cache_event('sql', hit is not None)
+        prompt_tokens = None
+        if hit:
+            sql, cache_match = hit[0].sql, hit[1]
+        else:
+            prompt, prompt_tokens = build_prompt_with_stats(results, payload.question)
+            sql, cache_match = generate_sql_from_prompt(prompt, priority=payload.priority), None
+        q = _history_row(payload.question, sql, payload.db_schema, current_user.id)
+        pending = [q]
+        if not hit:
+            pending.append(sql_cache.make_entry(payload.db_schema, version, OLLAMA_MODEL, ctx_key, payload.question, sql, q_emb, history_id=q.id))
+        history_writer.submit(*pending)
+        plan = _plan_summary(payload.conn_str, sql, current_user.role, current_user.id, cached_only=hit is not None)
+        return {'sql': sql, 'context': results, 'history_id': q.id, 'cache_hit': hit is not None, 'cache_match': cache_match, 'prompt_tokens': prompt_tokens, 'plan': plan}
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+def _plan_summary(conn_str: str, sql: str, role: str, user_id: int, cached_only: bool = False) -> Optional[dict]:
+    try:
+        return plan_query(conn_str, prepare_sql(sql, limit=1000, dialect=dialect_name(conn_str)), role, user_id=user_id, cached_only=cached_only)
+    except Exception as e:
+        return {'verdict': 'error', 'reason': str(e)}
+def _prepared_sql(payload: ExecIn, limit: int) -> str:
+    try:
+        return prepare_sql(payload.sql, limit=limit, dialect=dialect_name(payload.conn_str))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+def _preflight(payload: ExecIn, sql_ran: str, role: str, user_id: int) -> Optional[dict]:
+    try:
+        return preflight(payload.conn_str, sql_ran, role, confirm=payload.confirm, user_id=user_id)
+    except CostLimitError as e:
+        raise HTTPException(status_code=409 if e.needs_confirmation else 403, detail={'message': e.reason, 'plan': e.plan, 'needs_confirmation': e.needs_confirmation})
+    except AdmissionError as e:
+        raise _query_error(e)
+def _query_error(e: Exception) -> HTTPException:
+    if isinstance(e, AdmissionError):
+        return HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
+    if isinstance(e, QueryTimeoutError):
+        return HTTPException(status_code=504, detail=str(e))
+    return HTTPException(status_code=409, detail=str(e))
+def _query_id(payload: ExecIn) -> str:
+    query_id = payload.query_id or new_query_id()
+    if registry.get(query_id) is not None:
+        raise _query_error(QueryIdInUseError(f'Query id {query_id} is already in use'))
+    return query_id
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+def _history_row(question: str, sql: str, schema: str, user_id: int) -> QueryHistory:
+    return QueryHistory(id=history_writer.next_history_id(), question=question, sql=sql, schema=schema, user_id=user_id, created_at=datetime.utcnow())
+def _record_history(question: str, sql: str, schema: str, user_id: int) -> int:
+    q = _history_row(question, sql, schema, user_id)
+    history_writer.submit(q)
+    return q.id
+@app.post('/generate_sql/stream')
+async def generate_sql_stream(payload: QueryIn, current_user: User = Depends(get_current_user)):
+    try:
+        results = await run_in_threadpool(retrieve_context, payload.db_schema, payload.question, payload.top_k)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    prompt, prompt_tokens = build_prompt_with_stats(results, payload.question)
+    user_id = current_user.id
+    try:
+        await run_in_threadpool(scheduler.acquire, OLLAMA_MODEL, payload.priority, time.monotonic() + LLM_DEADLINE_SECONDS)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    released = []
+    def release_slot(started: Optional[float] = None):
+        if not released:
+            released.append(True)
+            scheduler.release(OLLAMA_MODEL, time.monotonic() - started if started else None)
+    async def events():
+        parts, started = [], None
+        try:
+            yield _sse('context', {'context': results, 'prompt_tokens': prompt_tokens})
+            started = time.monotonic()
+            async for token in stream_ollama_generate(prompt):
+                parts.append(token)
+                yield _sse('token', token)
+        except Exception as e:
+            yield _sse('error', str(e))
+            return
+        finally:
+            release_slot(started)
+        sql = clean_sql_output(''.join(parts).strip())
+        history_id = await run_in_threadpool(_record_history, payload.question, sql, payload.db_schema, user_id)
+        yield _sse('done', {'sql': sql, 'history_id': history_id})
+    try:
+        return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}, background=BackgroundTask(release_slot))
+    except BaseException:
+        release_slot()
+        raise
 @app.post('/execute_sql')
 def exec_sql(payload: ExecIn, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    sql_ran = _prepared_sql(payload, 1000)
+    cache_key = result_cache.make_key(connection_fingerprint(payload.conn_str), current_user.role, normalize_sql(sql_ran, dialect_name(payload.conn_str)))
+    cached = None if payload.no_cache else result_cache.get(cache_key)
+    if not payload.no_cache:
+        cache_event('result', cached is not None)
+    cache_status = 'HIT' if cached is not None else ('BYPASS' if payload.no_cache else 'MISS')
+    plan = None if cached is not None else _preflight(payload, sql_ran, current_user.role, current_user.id)
+    query_id = _query_id(payload)
+    track = {'query_id': query_id, 'user_id': current_user.id, 'role': current_user.role}
+    if payload.format in COLUMNAR_FORMATS:
+        try:
+            table = cached
+            if table is None:
+                with admitted(payload.conn_str, current_user.id):
+                    table = execute_arrow(payload.conn_str, sql_ran, **track)
+                result_cache.set(cache_key, table)
+            encode, media_type = COLUMNAR_FORMATS[payload.format]
+            headers = {'X-Row-Count': str(table.num_rows), 'X-Cache': cache_status, 'X-Query-Id': query_id}
+            if plan and plan.get('total_cost') is not None:
+                headers['X-Estimated-Cost'] = str(plan['total_cost'])
+            return Response(content=encode(table), media_type=media_type, headers=headers)
+        except (AdmissionError, QueryCancelledError, QueryTimeoutError, QueryIdInUseError) as e:
+            raise _query_error(e)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
     try:
-        df, sql_ran = execute_sql(payload.conn_str, payload.sql, limit=1000)
+        if cached is not None:
+            df = cached.to_pandas()
+        else:
+            with admitted(payload.conn_str, current_user.id):
+                df, sql_ran = execute_sql(payload.conn_str, payload.sql, limit=1000, **track)
+            try:
+                result_cache.set(cache_key, pa.Table.from_pandas(df, preserve_index=False))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                pass
         csv = df.to_csv(index=False)
-        return {'sql': sql_ran, 'rows': df.shape[0], 'columns': df.columns.tolist(), 'data': df.to_dict(orient='records'), 'csv': csv}
+        return {'sql': sql_ran, 'rows': df.shape[0], 'columns': df.columns.tolist(), 'data': df.to_dict(orient='records'), 'csv': csv, 'plan': plan, 'cache': cache_status, 'query_id': query_id}
+    except (AdmissionError, QueryCancelledError, QueryTimeoutError, QueryIdInUseError) as e:
+        raise _query_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+@app.post('/execute_sql/stream')
+def exec_sql_stream(payload: ExecStreamIn, current_user: User = Depends(get_current_user)):
+    streamers = {'ndjson': (stream_ndjson, 'application/x-ndjson'), 'csv': (stream_csv, 'text/csv')}
+    if payload.format not in streamers:
+        raise HTTPException(status_code=400, detail=f'Unsupported stream format: {payload.format}')
+    sql_ran = _prepared_sql(payload, STREAM_ROW_LIMIT)
+    _preflight(payload, sql_ran, current_user.role, current_user.id)
+    query_id = _query_id(payload)
+    try:
+        slot = AdmissionSlot(payload.conn_str, current_user.id, query_id)
+    except AdmissionError as e:
+        raise _query_error(e)
+    try:
+        streamer, media_type = streamers[payload.format]
+        rows = streamer(payload.conn_str, sql_ran, query_id=query_id, user_id=current_user.id, role=current_user.role)
+        return StreamingResponse(slot.stream(rows), media_type=media_type, headers={'X-Query-Id': query_id}, background=BackgroundTask(slot.close))
+    except BaseException:
+        slot.close()
+        raise
+@app.get('/queries')
+def list_queries(current_user: User = Depends(get_current_user)):
+    return {'queries': registry.list(None if current_user.role == 'admin' else current_user.id)}
+@app.post('/queries/{query_id}/cancel')
+def cancel_query(query_id: str, response: Response, current_user: User = Depends(get_current_user)):
+    q = registry.get(query_id)
+    if q is None:
+        try:
+            registry.request_cancel(query_id, current_user.id, current_user.role == 'admin')
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f'Cancel failed: {e}')
+        response.status_code = 202
+        return {'ok': True, 'query_id': query_id, 'status': 'requested'}
+    if q.user_id != current_user.id and current_user.role != 'admin':
+        raise HTTPException(status_code=404, detail='Query not found or already finished')
+    try:
+        cancelled = registry.cancel(query_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f'Cancel failed: {e}')
+    if not cancelled:
+        raise HTTPException(status_code=404, detail='Query not found or already finished')
+    return {'ok': True, 'query_id': query_id, 'status': 'cancelled'}
 @app.get('/history')
-def history(all: bool = False, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def history(all: bool = False, limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None, schema: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None, q: Optional[str] = None, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    history_writer.flush()
+    query = db.query(QueryHistory)
     if all:
         if current_user.role != 'admin':
             raise HTTPException(status_code=403, detail='Insufficient privileges to view all history')
-        items = db.query(QueryHistory).order_by(QueryHistory.created_at.desc()).all()
     else:
-        items = db.query(QueryHistory).filter(QueryHistory.user_id == current_user.id).order_by(QueryHistory.created_at.desc()).all()
-    out = [{'id': i.id, 'question': i.question, 'sql': i.sql, 'schema': i.schema, 'user_id': i.user_id, 'created_at': i.created_at.isoformat()} for i in items]
-    return {'history': out}
+        query = query.filter(QueryHistory.user_id == current_user.id)
+    if schema:
+        query = query.filter(QueryHistory.schema == schema)
+    if since:
+        query = query.filter(QueryHistory.created_at >= since)
+    if until:
+        query = query.filter(QueryHistory.created_at < until)
+    if q and q.strip():
+        if history_fts_available():
+            query = query.filter(text('query_history.id IN (SELECT rowid FROM query_history_fts WHERE query_history_fts MATCH :fts)')).params(fts=fts_match_expression(q))
+        else:
+            query = query.filter(QueryHistory.question.ilike(f'%{q.strip()}%'))
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+        query = query.filter(tuple_(QueryHistory.created_at, QueryHistory.id) < tuple_(cursor_created_at, cursor_id))
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    items = query.order_by(QueryHistory.created_at.desc(), QueryHistory.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(items[limit - 1].created_at, items[limit - 1].id) if len(items) > limit else None
+    out = [{'id': i.id, 'question': i.question, 'sql': i.sql, 'schema': i.schema, 'user_id': i.user_id, 'created_at': i.created_at.isoformat()} for i in items[:limit]]
+    return {'history': out, 'next_cursor': next_cursor}
+@app.get('/cache_stats')
+def get_cache_stats(current_user: User = Depends(require_role('admin'))):
+    return {**cache_stats(), 'llm_scheduler': scheduler.stats(), 'result_cache': result_cache.stats(), 'admission': admission.stats()}
+@app.delete('/result_cache')
+def purge_result_cache(current_user: User = Depends(require_role('admin'))):
+    result_cache.clear()
+    return {'ok': True}
+@app.delete('/sql_cache/{schema}')
+def purge_sql_cache(schema: str, current_user: User = Depends(require_role('admin')), db: Session = Depends(get_db)):
+    return {'ok': True, 'purged': sql_cache.purge(db, schema)}
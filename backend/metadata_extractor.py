@@ -1,7 +1,8 @@
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import inspect, text
+from engine_registry import get_engine
 from typing import List, Dict
 def extract_schema_metadata(conn_str: str, schema: str = 'public') -> List[Dict]:
-    engine = create_engine(conn_str)
+    engine = get_engine(conn_str)
     inspector = inspect(engine)
     metadata_entries = []
     for table_name in inspector.get_table_names(schema=schema):
@@ -0,0 +1,134 @@
+import time
+import inspect
+import threading
+from bisect import bisect_left
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Optional, Tuple
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_metrics = []
+_stage_timings = ContextVar('stage_timings', default=None)
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+def _label_str(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+    def inc(self, amount: float = 1.0, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+    def render(self) -> str:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{_label_str(self.labelnames, k)} {v:g}' for k, v in sorted(values.items()))
+        return '\n'.join(lines)
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+    def observe(self, value: float, *labels: str):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+    def render(self) -> str:
+        with self._lock:
+            snapshot = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, n) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float('inf'),), counts):
+                cumulative += c
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                lines.append(f'{self.name}_bucket{_label_str(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_label_str(self.labelnames, labels)} {total:.6f}')
+            lines.append(f'{self.name}_count{_label_str(self.labelnames, labels)} {n}')
+        return '\n'.join(lines)
+STAGE_SECONDS = Histogram('app_stage_seconds', 'Latency of individual request stages', ('stage',))
+REQUEST_SECONDS = Histogram('app_request_seconds', 'End-to-end HTTP request latency', ('method', 'route', 'status'))
+CACHE_EVENTS = Counter('app_cache_events_total', 'Cache lookups by cache and outcome', ('cache', 'outcome'))
+PROMPT_TOKENS = Counter('app_prompt_tokens_total', 'Estimated prompt tokens sent to the LLM')
+ROWS_RETURNED = Counter('app_rows_returned_total', 'Rows returned by executed SQL')
+HISTORY_DROPPED = Counter('app_history_rows_dropped_total', 'Write-behind history rows dropped after write failures')
+def cache_event(cache: str, hit: bool):
+    CACHE_EVENTS.inc(1.0, cache, 'hit' if hit else 'miss')
+def record_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+class timed(ContextDecorator):
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._started = None
+    def _recreate_cm(self):
+        return timed(self.stage)
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        record_stage(self.stage, time.perf_counter() - self._started)
+        return False
+    def __call__(self, func):
+        if not inspect.isgeneratorfunction(func):
+            return super().__call__(func)
+        @wraps(func)
+        def gen(*args, **kwargs):
+            with self._recreate_cm():
+                yield from func(*args, **kwargs)
+        return gen
+def start_request_timings() -> object:
+    return _stage_timings.set({})
+def finish_request_timings(token) -> Dict[str, float]:
+    timings = _stage_timings.get() or {}
+    _stage_timings.reset(token)
+    return timings
+def server_timing_header(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    parts = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items()]
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+class ServerTimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        token = start_request_timings()
+        started = time.perf_counter()
+        status = [500]
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                header = server_timing_header(_stage_timings.get() or {}, time.perf_counter() - started)
+                message = {**message, 'headers': list(message.get('headers') or []) + [(b'server-timing', header.encode('latin-1'))]}
+            await send(message)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            finish_request_timings(token)
+            endpoint = scope.get('endpoint')
+            REQUEST_SECONDS.observe(time.perf_counter() - started, scope.get('method', ''), getattr(endpoint, '__name__', 'unmatched'), str(status[0]))
+def render_metrics() -> str:
+    return '\n'.join(m.render() for m in _metrics) + '\n'
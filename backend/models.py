@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Index, Boolean, text
 from sqlalchemy.orm import relationship
 from db import Base
 from datetime import datetime
@@ -9,9 +9,15 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     role = Column(String, default='analyst', nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     histories = relationship('QueryHistory', back_populates='user')
 class QueryHistory(Base):
     __tablename__ = 'query_history'
+    __table_args__ = (
+        Index('ix_query_history_created', 'created_at', 'id'),
+        Index('ix_query_history_user_created', 'user_id', 'created_at', 'id'),
+        Index('ix_query_history_schema_created', 'schema', 'created_at', 'id'),
+    )
     id = Column(Integer, primary_key=True, index=True)
     question = Column(Text, nullable=False)
     sql = Column(Text, nullable=False)
@@ -23,4 +29,44 @@ class TokenBlacklist(Base):
     __tablename__ = 'token_blacklist'
     id = Column(Integer, primary_key=True, index=True)
     token = Column(Text, nullable=False, unique=True)
-    expires_at = Column(DateTime, nullable=True)
+    jti = Column(String, nullable=True, unique=True, index=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
+class SqlCacheEntry(Base):
+    __tablename__ = 'sql_cache'
+    __table_args__ = (Index('ix_sql_cache_lookup', 'schema', 'index_version', 'model', 'context_key'),)
+    id = Column(Integer, primary_key=True, index=True)
+    schema = Column(String, nullable=False)
+    index_version = Column(Integer, nullable=False, default=0)
+    model = Column(String, nullable=False)
+    context_key = Column(String, nullable=False)
+    question_norm = Column(Text, nullable=False)
+    question_embedding = Column(Text, nullable=True)
+    sql = Column(Text, nullable=False)
+    history_id = Column(Integer, ForeignKey('query_history.id'), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+class IdAllocator(Base):
+    __tablename__ = 'id_allocator'
+    name = Column(String, primary_key=True)
+    next_id = Column(Integer, nullable=False)
+class ExtractionJob(Base):
+    __tablename__ = 'extraction_jobs'
+    __table_args__ = (Index('ux_extraction_jobs_active_key', 'dedupe_key', unique=True, sqlite_where=text("status IN ('queued', 'running')")),)
+    id = Column(String, primary_key=True)
+    dedupe_key = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, default='queued', index=True)
+    db_type = Column(String, nullable=False)
+    schemas = Column(Text, nullable=False)
+    progress = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    owner = Column(String, nullable=True, index=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+class QueryCancelRequest(Base):
+    __tablename__ = 'query_cancel_requests'
+    query_id = Column(String, primary_key=True)
+    requested_by = Column(Integer, ForeignKey('users.id'), nullable=True)
+    admin = Column(Boolean, nullable=False, default=False)
+    requested_at = Column(DateTime, default=datetime.utcnow, index=True)
@@ -0,0 +1,234 @@
+import os
+import glob
+import json
+import uuid
+import fcntl
+import shutil
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR', '/data/vectors')
+VECTOR_DTYPE = os.environ.get('VECTOR_DTYPE', 'float16')
+QUERY_BLOCK_ROWS = 65536
+_collections = {}
+_collections_lock = threading.Lock()
+class NumpyCollection:
+    def __init__(self, name: str, directory: str = VECTOR_INDEX_DIR, dtype: str = VECTOR_DTYPE):
+        self.name = name
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.vec_path = os.path.join(directory, f'{name}.vec')
+        self.meta_path = os.path.join(directory, f'{name}.json')
+        self.lock_path = os.path.join(directory, f'{name}.lock')
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._lock_fd = None
+        self._prev_vec_path = None
+        self._mtime = None
+        self._dirty = False
+        self._matrix = None
+        self._reset()
+        self._reload()
+    def _reset(self):
+        self.metadata = {}
+        self.dim = None
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self._rows = {}
+        self._matrix = None
+    def _reload(self):
+        try:
+            mtime = os.path.getmtime(self.meta_path)
+        except OSError:
+            return
+        if mtime == self._mtime or self._write_depth:
+            return
+        with open(self.meta_path) as f:
+            data = json.load(f)
+        self.metadata = data.get('metadata') or {}
+        self.dim = data.get('dim')
+        self.dtype = np.dtype(data.get('dtype', self.dtype.name))
+        self.vec_path = os.path.join(self.directory, data.get('vec_file') or f'{self.name}.vec')
+        self.ids = data['ids']
+        self.documents = data['documents']
+        self.metadatas = data['metadatas']
+        self._rows = {_id: i for i, _id in enumerate(self.ids)}
+        self._matrix = None
+        self._mtime = mtime
+    def refresh(self):
+        with self._lock:
+            self._reload()
+    def _new_vec_path(self) -> str:
+        return os.path.join(self.directory, f'{self.name}.{uuid.uuid4().hex[:12]}.vec')
+    @contextmanager
+    def writing(self):
+        with self._write_lock:
+            if self._write_depth == 0:
+                self._begin_write()
+            self._write_depth += 1
+            try:
+                yield self
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._end_write()
+    def _begin_write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self._lock_fd = fd
+        with self._lock:
+            self._reload()
+            self._prev_vec_path = self.vec_path
+        for path in glob.glob(os.path.join(self.directory, f'{glob.escape(self.name)}.*.vec')):
+            if path != self.vec_path:
+                os.remove(path)
+    def _private_vectors(self):
+        if self.vec_path != self._prev_vec_path:
+            return
+        new_path = self._new_vec_path()
+        with open(new_path, 'wb') as out:
+            if self.ids and os.path.exists(self.vec_path):
+                with open(self.vec_path, 'rb') as src:
+                    shutil.copyfileobj(src, out)
+                out.truncate(len(self.ids) * self.dim * self.dtype.itemsize)
+        self.vec_path = new_path
+        self._matrix = None
+    def _end_write(self):
+        try:
+            with self._lock:
+                stale = None
+                if self._dirty:
+                    self._write_sidecar()
+                    if self.vec_path != self._prev_vec_path:
+                        stale = self._prev_vec_path
+                elif self.vec_path != self._prev_vec_path:
+                    stale, self.vec_path = self.vec_path, self._prev_vec_path
+                    self._matrix = None
+                self._prev_vec_path = None
+            if stale and os.path.exists(stale):
+                os.remove(stale)
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+    def _vectors(self) -> np.ndarray:
+        if self._matrix is None or self._matrix.shape[0] != len(self.ids):
+            if not self.ids:
+                return np.zeros((0, self.dim or 0), dtype=self.dtype)
+            if not os.path.exists(self.vec_path):
+                self._mtime = None
+                self._reload()
+            self._matrix = np.memmap(self.vec_path, dtype=self.dtype, mode='r', shape=(len(self.ids), self.dim))
+        return self._matrix
+    def _write_sidecar(self):
+        tmp = f'{self.meta_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'dim': self.dim, 'dtype': self.dtype.name, 'vec_file': os.path.basename(self.vec_path), 'metadata': self.metadata, 'ids': self.ids, 'documents': self.documents, 'metadatas': self.metadatas}, f)
+        os.replace(tmp, self.meta_path)
+        self._mtime = os.path.getmtime(self.meta_path)
+        self._dirty = False
+    def count(self) -> int:
+        with self._lock:
+            self._reload()
+            return len(self.ids)
+    def modify(self, metadata: Optional[Dict] = None, name: Optional[str] = None):
+        with self.writing(), self._lock:
+            self.metadata = dict(metadata or {})
+            self._dirty = True
+    def _normalize(self, embeddings) -> np.ndarray:
+        mat = np.asarray(embeddings, dtype=np.float32)
+        if mat.ndim == 1:
+            mat = mat[None, :]
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        return (mat / np.maximum(norms, 1e-12)).astype(self.dtype)
+    def upsert(self, ids: List[str], embeddings, metadatas: Optional[List[Dict]] = None, documents: Optional[List[str]] = None):
+        vectors = self._normalize(embeddings)
+        with self.writing(), self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f'Embedding dimension {vectors.shape[1]} does not match collection {self.name} dimension {self.dim}')
+            self._private_vectors()
+            updates, appends = [], []
+            for i, _id in enumerate(ids):
+                (updates if _id in self._rows else appends).append(i)
+            self._matrix = None
+            if updates:
+                mat = np.memmap(self.vec_path, dtype=self.dtype, mode='r+', shape=(len(self.ids), self.dim))
+                for i in updates:
+                    row = self._rows[ids[i]]
+                    mat[row] = vectors[i]
+                    self.documents[row] = documents[i] if documents else None
+                    self.metadatas[row] = metadatas[i] if metadatas else None
+                mat.flush()
+                del mat
+            if appends:
+                with open(self.vec_path, 'r+b') as f:
+                    f.seek(len(self.ids) * self.dim * self.dtype.itemsize)
+                    f.write(vectors[appends].tobytes())
+                for i in appends:
+                    self._rows[ids[i]] = len(self.ids)
+                    self.ids.append(ids[i])
+                    self.documents.append(documents[i] if documents else None)
+                    self.metadatas.append(metadatas[i] if metadatas else None)
+            self._dirty = True
+    def delete(self, ids: List[str]):
+        with self.writing(), self._lock:
+            doomed = {self._rows[_id] for _id in ids if _id in self._rows}
+            if not doomed:
+                return
+            self._private_vectors()
+            keep = [i for i in range(len(self.ids)) if i not in doomed]
+            kept = np.array(self._vectors()[keep]) if keep else np.zeros((0, self.dim), dtype=self.dtype)
+            self._matrix = None
+            path = self._new_vec_path()
+            kept.tofile(path)
+            if self.vec_path != self._prev_vec_path:
+                os.remove(self.vec_path)
+            self.vec_path = path
+            self.ids = [self.ids[i] for i in keep]
+            self.documents = [self.documents[i] for i in keep]
+            self.metadatas = [self.metadatas[i] for i in keep]
+            self._rows = {_id: i for i, _id in enumerate(self.ids)}
+            self._dirty = True
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None) -> Dict:
+        include = include or ['metadatas', 'documents']
+        with self._lock:
+            self._reload()
+            rows = range(len(self.ids)) if ids is None else [self._rows[_id] for _id in ids if _id in self._rows]
+            out = {'ids': [self.ids[i] for i in rows]}
+            if 'documents' in include:
+                out['documents'] = [self.documents[i] for i in rows]
+            if 'metadatas' in include:
+                out['metadatas'] = [self.metadatas[i] for i in rows]
+            return out
+    def query(self, query_embeddings, n_results: int = 10, include: Optional[List[str]] = None) -> Dict:
+        include = include or ['metadatas', 'documents', 'distances']
+        with self._lock:
+            self._reload()
+            mat = self._vectors()
+            ids, documents, metadatas = self.ids, self.documents, self.metadatas
+        out = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        for q in self._normalize(query_embeddings).astype(np.float32):
+            scores = np.empty(mat.shape[0], dtype=np.float32)
+            for start in range(0, mat.shape[0], QUERY_BLOCK_ROWS):
+                block = mat[start:start + QUERY_BLOCK_ROWS]
+                scores[start:start + block.shape[0]] = block.astype(np.float32, copy=False) @ q
+            k = min(n_results, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k] if k else np.array([], dtype=np.int64)
+            top = top[np.argsort(-scores[top])]
+            out['ids'].append([ids[i] for i in top])
+            out['documents'].append([documents[i] for i in top] if 'documents' in include else None)
+            out['metadatas'].append([metadatas[i] for i in top] if 'metadatas' in include else None)
+            out['distances'].append([float(1.0 - scores[i]) for i in top] if 'distances' in include else None)
+        return out
+def get_numpy_collection(name: str) -> NumpyCollection:
+    with _collections_lock:
+        col = _collections.get(name)
+        if col is None:
+            col = _collections[name] = NumpyCollection(name)
+        return col
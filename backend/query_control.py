@@ -0,0 +1,311 @@
+import os
+import math
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, List, Optional
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from db import SessionLocal
+from models import QueryCancelRequest
+from engine_registry import get_engine, connection_fingerprint
+QUERY_MAX_PER_TARGET = int(os.environ.get('QUERY_MAX_PER_TARGET', '8'))
+QUERY_MAX_PER_USER = int(os.environ.get('QUERY_MAX_PER_USER', '2'))
+QUERY_MAX_QUEUE = int(os.environ.get('QUERY_MAX_QUEUE', '16'))
+QUERY_QUEUE_TIMEOUT = float(os.environ.get('QUERY_QUEUE_TIMEOUT', '10'))
+STATEMENT_TIMEOUT_SECONDS = os.environ.get('STATEMENT_TIMEOUT_SECONDS', '60')
+QUERY_CANCEL_POLL_SECONDS = float(os.environ.get('QUERY_CANCEL_POLL_SECONDS', '1'))
+QUERY_CANCEL_TTL = float(os.environ.get('QUERY_CANCEL_TTL', '3600'))
+TIMEOUT_ERROR_CODES = {'57014', 3024, 1969}
+class AdmissionError(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+class QueryCancelledError(Exception):
+    pass
+class QueryTimeoutError(Exception):
+    pass
+class QueryIdInUseError(Exception):
+    pass
+def statement_timeout(role: Optional[str]) -> float:
+    return float(os.environ.get(f'STATEMENT_TIMEOUT_SECONDS_{(role or "analyst").upper()}', STATEMENT_TIMEOUT_SECONDS))
+class _Target:
+    def __init__(self):
+        self.active = 0
+        self.waiting = deque()
+        self.avg_seconds = 1.0
+        self.cond = threading.Condition()
+class AdmissionController:
+    def __init__(self, per_target: int = QUERY_MAX_PER_TARGET, per_user: int = QUERY_MAX_PER_USER, max_queue: int = QUERY_MAX_QUEUE, queue_timeout: float = QUERY_QUEUE_TIMEOUT):
+        self.per_target = per_target
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rejected = 0
+        self._targets = {}
+        self._users = {}
+        self._lock = threading.Lock()
+    def _target(self, target: str) -> _Target:
+        with self._lock:
+            t = self._targets.get(target)
+            if t is None:
+                t = self._targets[target] = _Target()
+            return t
+    def _retry_after(self, t: _Target) -> int:
+        return max(1, math.ceil(t.avg_seconds * (len(t.waiting) + 1) / self.per_target))
+    def _reject(self, reason: str, t: _Target):
+        self.rejected += 1
+        raise AdmissionError(reason, self._retry_after(t))
+    def acquire(self, target: str, user: Hashable):
+        t = self._target(target)
+        with t.cond:
+            with self._lock:
+                held = self._users.get(user, 0)
+                if held >= self.per_user:
+                    self._reject(f'Too many concurrent queries for this user (limit {self.per_user})', t)
+                if t.active >= self.per_target and len(t.waiting) >= self.max_queue:
+                    self._reject('Target database is busy, query queue is full', t)
+                self._users[user] = held + 1
+            if t.active < self.per_target and not t.waiting:
+                t.active += 1
+                return
+            ticket = object()
+            t.waiting.append(ticket)
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while not (t.active < self.per_target and t.waiting[0] is ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject('Timed out waiting for a query slot on the target database', t)
+                    t.cond.wait(remaining)
+                t.waiting.popleft()
+                t.active += 1
+            except BaseException:
+                if ticket in t.waiting:
+                    t.waiting.remove(ticket)
+                self._release_user(user)
+                raise
+            finally:
+                t.cond.notify_all()
+    def _release_user(self, user: Hashable):
+        with self._lock:
+            held = self._users.get(user, 0) - 1
+            if held > 0:
+                self._users[user] = held
+            else:
+                self._users.pop(user, None)
+    def release(self, target: str, user: Hashable, elapsed: Optional[float] = None):
+        t = self._target(target)
+        with t.cond:
+            t.active -= 1
+            if elapsed is not None:
+                t.avg_seconds = 0.8 * t.avg_seconds + 0.2 * elapsed
+            self._release_user(user)
+            t.cond.notify_all()
+    def stats(self) -> Dict:
+        with self._lock:
+            targets = dict(self._targets)
+            users = len(self._users)
+        return {'rejected': self.rejected, 'active_users': users, 'targets': {fp[:12]: {'active': t.active, 'waiting': len(t.waiting), 'avg_seconds': round(t.avg_seconds, 3)} for fp, t in targets.items()}}
+class _RunningQuery:
+    def __init__(self, query_id: str, user_id, conn_str: str, dialect: str, dbapi_conn, backend_id):
+        self.query_id = query_id
+        self.user_id = user_id
+        self.conn_str = conn_str
+        self.dialect = dialect
+        self.dbapi_conn = dbapi_conn
+        self.backend_id = backend_id
+        self.started = time.monotonic()
+        self.cancelled = False
+        self.timed_out = False
+class QueryRegistry:
+    def __init__(self):
+        self._queries = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+    def register(self, q: _RunningQuery):
+        with self._lock:
+            if q.query_id in self._queries:
+                raise QueryIdInUseError(f'Query id {q.query_id} is already in use')
+            self._queries[q.query_id] = q
+    def unregister(self, q: _RunningQuery):
+        with self._lock:
+            if self._queries.get(q.query_id) is q:
+                del self._queries[q.query_id]
+    def get(self, query_id: str) -> Optional[_RunningQuery]:
+        with self._lock:
+            return self._queries.get(query_id)
+    def list(self, user_id=None) -> List[Dict]:
+        with self._lock:
+            queries = list(self._queries.values())
+        now = time.monotonic()
+        return [{'query_id': q.query_id, 'user_id': q.user_id, 'dialect': q.dialect, 'seconds': round(now - q.started, 3)} for q in queries if user_id is None or q.user_id == user_id]
+    def cancel(self, query_id: str, timed_out: bool = False) -> bool:
+        q = self.get(query_id)
+        if q is None:
+            return False
+        q.cancelled = q.cancelled or not timed_out
+        q.timed_out = q.timed_out or timed_out
+        if q.dialect == 'sqlite':
+            q.dbapi_conn.interrupt()
+        elif hasattr(q.dbapi_conn, 'cancel'):
+            q.dbapi_conn.cancel()
+        elif q.backend_id is not None:
+            stmt = f'SELECT pg_cancel_backend({int(q.backend_id)})' if q.dialect == 'postgresql' else f'KILL QUERY {int(q.backend_id)}'
+            with get_engine(q.conn_str).connect() as conn:
+                conn.execute(text(stmt))
+        else:
+            return False
+        return True
+    def request_cancel(self, query_id: str, user_id, admin: bool = False):
+        db = SessionLocal()
+        try:
+            db.query(QueryCancelRequest).filter(QueryCancelRequest.requested_at < datetime.utcnow() - timedelta(seconds=QUERY_CANCEL_TTL)).delete(synchronize_session=False)
+            db.merge(QueryCancelRequest(query_id=query_id, requested_by=user_id, admin=admin, requested_at=datetime.utcnow()))
+            db.commit()
+        finally:
+            db.close()
+    def _watch(self):
+        with self._lock:
+            local = list(self._queries)
+        if not local:
+            return
+        db = SessionLocal()
+        try:
+            requests = db.query(QueryCancelRequest).filter(QueryCancelRequest.query_id.in_(local)).all()
+            for r in requests:
+                q = self.get(r.query_id)
+                if q is not None and (r.admin or q.user_id == r.requested_by):
+                    self.cancel(r.query_id)
+            if requests:
+                db.query(QueryCancelRequest).filter(QueryCancelRequest.query_id.in_([r.query_id for r in requests])).delete(synchronize_session=False)
+                db.commit()
+        finally:
+            db.close()
+    def _watch_loop(self):
+        while not self._stop.wait(QUERY_CANCEL_POLL_SECONDS):
+            try:
+                self._watch()
+            except Exception:
+                pass
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch_loop, name='query-cancel-watch', daemon=True)
+            self._thread.start()
+    def stop(self):
+        self._stop.set()
+admission = AdmissionController()
+registry = QueryRegistry()
+def new_query_id() -> str:
+    return uuid.uuid4().hex
+def _backend_id(conn, dialect: str):
+    if dialect == 'postgresql':
+        return conn.execute(text('SELECT pg_backend_pid()')).scalar()
+    if dialect in ('mysql', 'mariadb'):
+        return conn.execute(text('SELECT CONNECTION_ID()')).scalar()
+    return None
+def _is_mariadb(conn, dialect: str) -> bool:
+    return dialect == 'mariadb' or getattr(conn.dialect, 'is_mariadb', False)
+def _apply_timeout(conn, dialect: str, seconds: float) -> bool:
+    if dialect == 'postgresql':
+        conn.execute(text(f'SET LOCAL statement_timeout = {int(seconds * 1000)}'))
+        return True
+    if dialect in ('mysql', 'mariadb'):
+        if _is_mariadb(conn, dialect):
+            conn.execute(text(f'SET SESSION max_statement_time = {seconds:g}'))
+        else:
+            conn.execute(text(f'SET SESSION max_execution_time = {int(seconds * 1000)}'))
+        return True
+    return False
+def _reset_timeout(conn, dialect: str):
+    try:
+        conn.rollback()
+        conn.execute(text('SET SESSION max_statement_time = DEFAULT' if _is_mariadb(conn, dialect) else 'SET SESSION max_execution_time = DEFAULT'))
+        conn.commit()
+    except Exception:
+        conn.invalidate()
+@contextmanager
+def tracked_connection(conn_str: str, query_id: Optional[str] = None, user_id=None, role: Optional[str] = None) -> Iterator:
+    engine = get_engine(conn_str)
+    dialect = engine.dialect.name
+    query_id = query_id or new_query_id()
+    timeout = statement_timeout(role)
+    with engine.connect() as conn:
+        native = timeout > 0 and _apply_timeout(conn, dialect, timeout)
+        dbapi_conn = conn.connection.dbapi_connection
+        backend_id = None if dialect == 'sqlite' or hasattr(dbapi_conn, 'cancel') else _backend_id(conn, dialect)
+        q = _RunningQuery(query_id, user_id, conn_str, dialect, dbapi_conn, backend_id)
+        registry.register(q)
+        timer = None
+        if timeout > 0 and not native:
+            timer = threading.Timer(timeout, registry.cancel, args=(query_id,), kwargs={'timed_out': True})
+            timer.daemon = True
+            timer.start()
+        try:
+            yield conn
+        except DBAPIError as e:
+            code = getattr(e.orig, 'pgcode', None) or (e.orig.args[0] if getattr(e.orig, 'args', None) else None)
+            if q.cancelled:
+                raise QueryCancelledError(f'Query {query_id} was cancelled') from e
+            if q.timed_out or code in TIMEOUT_ERROR_CODES:
+                raise QueryTimeoutError(f'Query {query_id} exceeded the statement timeout of {timeout:g}s') from e
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            registry.unregister(q)
+            if native and dialect in ('mysql', 'mariadb'):
+                _reset_timeout(conn, dialect)
+@contextmanager
+def admitted(conn_str: str, user_id) -> Iterator[None]:
+    target = connection_fingerprint(conn_str)
+    admission.acquire(target, user_id)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        admission.release(target, user_id, time.monotonic() - started)
+class AdmissionSlot:
+    def __init__(self, conn_str: str, user_id, query_id: Optional[str] = None):
+        self.target = connection_fingerprint(conn_str)
+        self.user_id = user_id
+        self.query_id = query_id
+        admission.acquire(self.target, user_id)
+        self.started = time.monotonic()
+        self._released = False
+        self._closed = False
+        self._lock = threading.Lock()
+        self._gen = None
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        admission.release(self.target, self.user_id, time.monotonic() - self.started)
+    def stream(self, gen: Iterator) -> Iterator:
+        self._gen = self._wrap(gen)
+        return self._gen
+    def _wrap(self, gen: Iterator) -> Iterator:
+        try:
+            for chunk in gen:
+                if self._closed:
+                    break
+                yield chunk
+        finally:
+            gen.close()
+            self.release()
+    def close(self):
+        self._closed = True
+        try:
+            if self._gen is not None:
+                self._gen.close()
+        except ValueError:
+            if self.query_id:
+                registry.cancel(self.query_id)
+            return
+        self.release()
@@ -0,0 +1,135 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+import pyarrow as pa
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '300'))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('RESULT_CACHE_MAX_ENTRY_BYTES', str(RESULT_CACHE_MAX_BYTES // 4)))
+RESULT_CACHE_SPILL_DIR = os.environ.get('RESULT_CACHE_SPILL_DIR', '')
+RESULT_CACHE_SPILL_MAX_BYTES = int(os.environ.get('RESULT_CACHE_SPILL_MAX_BYTES', str(1024 * 1024 * 1024)))
+_IPC_OPTIONS = pa.ipc.IpcWriteOptions(compression='zstd')
+def serialize_table(table: pa.Table) -> bytes:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=_IPC_OPTIONS) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+def deserialize_table(data: bytes) -> pa.Table:
+    return pa.ipc.open_stream(data).read_all()
+class ResultCache:
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: float = RESULT_CACHE_TTL, max_entry_bytes: int = RESULT_CACHE_MAX_ENTRY_BYTES, spill_dir: str = RESULT_CACHE_SPILL_DIR, spill_max_bytes: int = RESULT_CACHE_SPILL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.spill_dir = os.path.join(spill_dir, str(os.getpid())) if spill_dir else ''
+        self.spill_max_bytes = spill_max_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._mem = OrderedDict()
+        self._disk = OrderedDict()
+        self._lock = threading.Lock()
+        if self.spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            os.makedirs(self.spill_dir, exist_ok=True)
+    @staticmethod
+    def make_key(*parts: Hashable) -> str:
+        return hashlib.sha256('\x1f'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+    def _spill_path(self, key: str) -> str:
+        return os.path.join(self.spill_dir, f'{key}.arrow')
+    def get(self, key: str) -> Optional[pa.Table]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None and item[0] >= now:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return deserialize_table(item[1])
+            if item is not None:
+                self._drop_mem(key)
+            spilled = self._disk.pop(key, None)
+        if spilled is not None:
+            expires, nbytes = spilled
+            path = self._spill_path(key)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.remove(path)
+            except OSError:
+                data = None
+            with self._lock:
+                self._disk_bytes -= nbytes
+            if data is not None and expires >= now:
+                self._store(key, data, expires)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return deserialize_table(data)
+        with self._lock:
+            self.misses += 1
+        return None
+    def set(self, key: str, table: pa.Table, ttl: Optional[float] = None) -> bool:
+        data = serialize_table(table)
+        if len(data) > self.max_entry_bytes:
+            return False
+        self._store(key, data, time.monotonic() + (self.ttl if ttl is None else ttl))
+        return True
+    def _drop_mem(self, key: str):
+        _, data = self._mem.pop(key)
+        self._bytes -= len(data)
+    def _store(self, key: str, data: bytes, expires: float):
+        evicted = []
+        with self._lock:
+            if key in self._mem:
+                self._drop_mem(key)
+            self._mem[key] = (expires, data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._mem:
+                old_key, (old_expires, old_data) = self._mem.popitem(last=False)
+                self._bytes -= len(old_data)
+                self.evictions += 1
+                evicted.append((old_key, old_expires, old_data))
+        if self.spill_dir:
+            self._spill(evicted)
+    def _spill(self, evicted: List[Tuple[str, float, bytes]]):
+        now = time.monotonic()
+        for key, expires, data in evicted:
+            if expires < now or len(data) > self.spill_max_bytes:
+                continue
+            with open(self._spill_path(key), 'wb') as f:
+                f.write(data)
+            doomed = []
+            with self._lock:
+                self._disk[key] = (expires, len(data))
+                self._disk_bytes += len(data)
+                while self._disk_bytes > self.spill_max_bytes and self._disk:
+                    old_key, (_, nbytes) = self._disk.popitem(last=False)
+                    self._disk_bytes -= nbytes
+                    doomed.append(old_key)
+            for old_key in doomed:
+                try:
+                    os.remove(self._spill_path(old_key))
+                except OSError:
+                    pass
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            doomed = list(self._disk)
+            self._disk.clear()
+            self._bytes = self._disk_bytes = 0
+        for key in doomed:
+            try:
+                os.remove(self._spill_path(key))
+            except OSError:
+                pass
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {'entries': len(self._mem), 'bytes': self._bytes, 'max_bytes': self.max_bytes, 'spilled_entries': len(self._disk), 'spilled_bytes': self._disk_bytes, 'ttl': self.ttl, 'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': self.evictions, 'hit_ratio': (self.hits / total) if total else 0.0}
+result_cache = ResultCache()
@@ -0,0 +1,47 @@
+import os
+import json
+import hashlib
+import numpy as np
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy.orm import Session
+from models import SqlCacheEntry
+from cache import TTLCache
+from vector_indexer import normalize_query
+from metrics import timed
+SIMILARITY_THRESHOLD = float(os.environ.get('SQL_CACHE_SIMILARITY', '0.95'))
+CANDIDATE_LIMIT = int(os.environ.get('SQL_CACHE_CANDIDATES', '200'))
+PENDING_TTL = float(os.environ.get('SQL_CACHE_PENDING_TTL', '60'))
+_pending = TTLCache(maxsize=1024, ttl=PENDING_TTL)
+def context_key(context_entries: List[dict]) -> str:
+    ids = sorted(str(e.get('id')) for e in context_entries)
+    return hashlib.sha1('\n'.join(ids).encode('utf-8')).hexdigest()
+@timed('sql_cache_lookup')
+def lookup(db: Session, schema: str, index_version: int, model: str, ctx_key: str, question: str, question_embedding: Optional[List[float]] = None) -> Optional[Tuple[SqlCacheEntry, str]]:
+    pending = _pending.get((schema, index_version, model, ctx_key, normalize_query(question)))
+    if pending is not None:
+        return SqlCacheEntry(schema=schema, index_version=index_version, model=model, context_key=ctx_key, question_norm=normalize_query(question), sql=pending), 'exact'
+    base = db.query(SqlCacheEntry).filter(SqlCacheEntry.schema == schema, SqlCacheEntry.index_version == index_version, SqlCacheEntry.model == model, SqlCacheEntry.context_key == ctx_key)
+    exact = base.filter(SqlCacheEntry.question_norm == normalize_query(question)).order_by(SqlCacheEntry.id.desc()).first()
+    if exact is not None:
+        return exact, 'exact'
+    if question_embedding is None or SIMILARITY_THRESHOLD > 1.0:
+        return None
+    candidates = [c for c in base.order_by(SqlCacheEntry.id.desc()).limit(CANDIDATE_LIMIT).all() if c.question_embedding]
+    if not candidates:
+        return None
+    mat = np.array([json.loads(c.question_embedding) for c in candidates], dtype=np.float32)
+    q = np.asarray(question_embedding, dtype=np.float32)
+    sims = (mat @ q) / (np.linalg.norm(mat, axis=1) * np.linalg.norm(q) + 1e-12)
+    best = int(np.argmax(sims))
+    if sims[best] >= SIMILARITY_THRESHOLD:
+        return candidates[best], 'similar'
+    return None
+def make_entry(schema: str, index_version: int, model: str, ctx_key: str, question: str, sql: str, question_embedding: Optional[List[float]] = None, history_id: Optional[int] = None) -> SqlCacheEntry:
+    _pending.set((schema, index_version, model, ctx_key, normalize_query(question)), sql)
+    return SqlCacheEntry(schema=schema, index_version=index_version, model=model, context_key=ctx_key, question_norm=normalize_query(question), question_embedding=json.dumps(question_embedding) if question_embedding is not None else None, sql=sql, history_id=history_id, created_at=datetime.utcnow())
+def purge(db: Session, schema: str) -> int:
+    _pending.invalidate(lambda key: key[0] == schema)
+    n = db.query(SqlCacheEntry).filter(SqlCacheEntry.schema == schema).delete(synchronize_session=False)
+    db.commit()
+    return n
@@ -1,36 +1,189 @@
 import os
+import re
+import json
 import requests
-from typing import List
+import httpx
+from requests.adapters import HTTPAdapter
+from typing import AsyncIterator, List, Optional, Tuple
+from utils import tokenize
+from llm_scheduler import scheduler
+from metrics import timed, PROMPT_TOKENS
 OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://localhost:11434')
 OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'sqlcoder-34b')
-def build_prompt(context_entries: List[dict], user_question: str) -> str:
-    ctx_texts = []
-    for e in context_entries:
-        ctx_texts.append(f"- {e.get('document')}")
-    ctx_block = "\n".join(ctx_texts)
-    prompt = f"Schema Context:\n{ctx_block}\n\nQuestion:\n{user_question}\n\nGenerate a correct ANSI SQL query for PostgreSQL that answers the question using the schema context. Return only the SQL statement, without backticks or explanation. Use explicit schema.table references when possible. Limit results to reasonable rows if applicable (e.g., LIMIT 100). Do not run destructive statements."
-    return prompt
-def call_ollama_generate(prompt: str, model: str = None, max_tokens: int = 512) -> str:
-    model = model or OLLAMA_MODEL
-    url = f"{OLLAMA_URL}/api/generate"
-    payload = {"model": model, "prompt": prompt, "max_tokens": max_tokens, "temperature": 0.0}
-    resp = requests.post(url, json=payload, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
+OLLAMA_TIMEOUT = float(os.environ.get('OLLAMA_TIMEOUT', '60'))
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get('OLLAMA_MAX_CONNECTIONS', '32'))
+SQL_START_KEYWORDS = ['SELECT', 'WITH', 'SHOW', 'EXPLAIN', 'INSERT']
+_session = None
+_async_client = None
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_MAX_CONNECTIONS)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+def _get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        limits = httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS, max_keepalive_connections=OLLAMA_MAX_CONNECTIONS)
+        _async_client = httpx.AsyncClient(base_url=OLLAMA_URL, timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=5.0), limits=limits)
+    return _async_client
+async def close_clients():
+    global _async_client, _session
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _session is not None:
+        _session.close()
+        _session = None
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '1500'))
+PROMPT_MAX_COLUMNS = int(os.environ.get('PROMPT_MAX_COLUMNS', '24'))
+PROMPT_INSTRUCTIONS = "Generate a correct ANSI SQL query for PostgreSQL that answers the question using the schema context. Return only the SQL statement, without backticks or explanation. Use explicit schema.table references when possible. Limit results to reasonable rows if applicable (e.g., LIMIT 100). Do not run destructive statements."
+TYPE_ABBREVIATIONS = [
+    ('timestamp with time zone', 'tstz'), ('timestamp without time zone', 'ts'), ('timestamp', 'ts'),
+    ('character varying', 'varchar'), ('varchar', 'varchar'), ('character', 'char'), ('double precision', 'float8'),
+    ('numeric', 'num'), ('decimal', 'num'), ('bigint', 'int8'), ('smallint', 'int2'), ('integer', 'int'),
+    ('boolean', 'bool'), ('text', 'text'), ('jsonb', 'jsonb'), ('json', 'json'), ('date', 'date'), ('uuid', 'uuid'),
+]
+_TOKEN_PIECES = re.compile(r'[A-Za-z]+|\d+|[^\sA-Za-z\d]')
+def estimate_tokens(text: str) -> int:
+    return len(_TOKEN_PIECES.findall(text or ''))
+def abbreviate_type(type_name: str) -> str:
+    t = re.sub(r'\(.*?\)', '', (type_name or '').lower()).strip()
+    for full, short in TYPE_ABBREVIATIONS:
+        if t.startswith(full):
+            return short + ('[]' if t.endswith('[]') else '')
+    return t
+def _ranked_columns(entry: dict, question_terms: set, shared: set) -> List[Tuple[float, str]]:
+    meta = entry.get('metadata') or {}
+    matched = set(entry.get('matched_columns') or [])
+    keys = set(meta.get('primary_key') or [])
+    for fk in meta.get('foreign_keys') or []:
+        keys.update(fk.get('constrained_columns') or [])
+    ranked = []
+    for pos, c in enumerate(meta.get('columns') or []):
+        name, short = c.get('name'), abbreviate_type(c.get('type'))
+        if (name, short) in shared:
+            continue
+        score = 3.0 * (name in matched) + 2.0 * (name in keys) + len(question_terms.intersection(tokenize(name))) - pos * 1e-6
+        ranked.append((score, f"{name}{'*' if name in (meta.get('primary_key') or []) else ''} {short}"))
+    ranked.sort(key=lambda x: x[0], reverse=True)
+    return ranked
+def _compact_entry(entry: dict, question_terms: set, shared: set, max_columns: int) -> str:
+    meta = entry.get('metadata') or {}
+    if not meta.get('columns'):
+        return f"- {entry.get('document')}"
+    ranked = _ranked_columns(entry, question_terms, shared)
+    cols = [c for _, c in ranked[:max_columns]]
+    if len(ranked) > max_columns:
+        cols.append(f"+{len(ranked) - max_columns} more")
+    kind = 'view ' if meta.get('type') == 'view' else ''
+    return f"- {kind}{entry.get('id')}({', '.join(cols)})"
+def _render_prompt(lines: List[str], shared: List[str], joins: List[str], user_question: str) -> str:
+    ctx_block = "\n".join(lines)
+    if shared:
+        ctx_block += "\nColumns on every table above: " + ", ".join(shared)
+    if joins:
+        ctx_block += "\n\nJoin Conditions:\n" + "\n".join(f"- {j}" for j in joins)
+    return f"Schema Context (name type, * = primary key):\n{ctx_block}\n\nQuestion:\n{user_question}\n\n{PROMPT_INSTRUCTIONS}"
+@timed('prompt_build')
+def build_prompt_with_stats(context_entries: List[dict], user_question: str, token_budget: Optional[int] = None) -> Tuple[str, int]:
+    budget = token_budget or PROMPT_TOKEN_BUDGET
+    question_terms = set(tokenize(user_question))
+    entries = list(context_entries)
+    max_columns = PROMPT_MAX_COLUMNS
+    while True:
+        column_sets = [{(c.get('name'), abbreviate_type(c.get('type'))) for c in (e.get('metadata') or {}).get('columns') or []} for e in entries]
+        shared = set.intersection(*column_sets) if len(column_sets) > 1 else set()
+        keys = {k for e in entries for k in (e.get('metadata') or {}).get('primary_key') or []}
+        shared = {c for c in shared if c[0] not in keys and not question_terms.intersection(tokenize(c[0]))}
+        lines = [_compact_entry(e, question_terms, shared, max_columns) for e in entries]
+        kept = {e.get('id') for e in entries}
+        joins = [j for j in dict.fromkeys(j for e in entries for j in e.get('joins') or []) if all(t in kept for t in re.findall(r'([\w$]+\.[\w$]+)\.[\w$]+', j))]
+        prompt = _render_prompt(lines, sorted(f"{n} {t}" for n, t in shared), joins, user_question)
+        tokens = estimate_tokens(prompt)
+        if tokens <= budget:
+            PROMPT_TOKENS.inc(tokens)
+            return prompt, tokens
+        if len(entries) > 1:
+            entries.pop()
+        elif max_columns > 4:
+            max_columns //= 2
+        else:
+            PROMPT_TOKENS.inc(tokens)
+            return prompt, tokens
+def build_prompt(context_entries: List[dict], user_question: str, token_budget: Optional[int] = None) -> str:
+    return build_prompt_with_stats(context_entries, user_question, token_budget)[0]
+def _generate_payload(prompt: str, model: str, max_tokens: int, stream: bool) -> dict:
+    return {"model": model, "prompt": prompt, "stream": stream, "max_tokens": max_tokens, "temperature": 0.0, "options": {"num_predict": max_tokens, "temperature": 0.0}}
+def _completion_text(data) -> str:
     if isinstance(data, dict) and 'choices' in data:
         content = data['choices'][0].get('message', {}).get('content')
         if content:
             return content.strip()
+    if isinstance(data, dict) and 'response' in data:
+        return data['response'].strip()
     if isinstance(data, dict) and 'text' in data:
         return data['text'].strip()
     return str(data)
-def generate_sql_from_context(context_entries: List[dict], user_question: str) -> str:
-    prompt = build_prompt(context_entries, user_question)
-    sql = call_ollama_generate(prompt)
+@timed('llm_generate')
+def call_ollama_generate(prompt: str, model: str = None, max_tokens: int = 512, timeout: Optional[float] = None) -> str:
+    model = model or OLLAMA_MODEL
+    url = f"{OLLAMA_URL}/api/generate"
+    timeout = min(timeout, OLLAMA_TIMEOUT) if timeout else OLLAMA_TIMEOUT
+    resp = _get_session().post(url, json=_generate_payload(prompt, model, max_tokens, False), timeout=timeout)
+    resp.raise_for_status()
+    return _completion_text(resp.json())
+def sql_statement_complete(text: str) -> bool:
+    upper = text.upper()
+    if not any(k in upper for k in SQL_START_KEYWORDS):
+        return False
+    quote = None
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == '-' and text.startswith('--', i):
+            nl = text.find('\n', i)
+            if nl < 0:
+                return False
+            i = nl
+        elif ch == ';':
+            return True
+        i += 1
+    return False
+async def stream_ollama_generate(prompt: str, model: str = None, max_tokens: int = 512) -> AsyncIterator[str]:
+    model = model or OLLAMA_MODEL
+    emitted = ''
+    with timed('llm_stream'):
+        async with _get_async_client().stream('POST', '/api/generate', json=_generate_payload(prompt, model, max_tokens, True)) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                token = data.get('response', '')
+                if token:
+                    emitted += token
+                    yield token
+                if data.get('done') or sql_statement_complete(emitted):
+                    break
+def clean_sql_output(sql: str) -> str:
     if '\n' in sql:
         s = sql.strip()
-        for keyword in ['SELECT', 'WITH', 'SHOW', 'EXPLAIN', 'INSERT']:
+        for keyword in SQL_START_KEYWORDS:
             idx = s.upper().find(keyword)
             if idx >= 0:
                 return s[idx:]
     return sql
+def generate_sql_from_prompt(prompt: str, priority: str = 'interactive') -> str:
+    sql = scheduler.run(OLLAMA_MODEL, prompt, lambda timeout: call_ollama_generate(prompt, OLLAMA_MODEL, timeout=timeout), priority=priority)
+    return clean_sql_output(sql)
+def generate_sql_from_context(context_entries: List[dict], user_question: str, priority: str = 'interactive') -> str:
+    return generate_sql_from_prompt(build_prompt(context_entries, user_question), priority=priority)
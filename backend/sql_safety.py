@@ -0,0 +1,192 @@
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+SQL_ANALYSIS_CACHE_SIZE = 4096
+_TOKEN_RE = re.compile(
+    r"(?P<ws>\s+)"
+    r"|(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<string>[Ee]'(?:[^'\\]|''|\\.)*'|[BbXxNn]?'(?:[^']|'')*'|\$(?P<tag>(?:[A-Za-z_][A-Za-z_0-9]*)?)\$.*?\$(?P=tag)\$)"
+    r"|(?P<ident>\"(?:[^\"]|\"\")*\"|`[^`]*`)"
+    r"|(?P<word>[A-Za-z_][A-Za-z_0-9$]*)"
+    r"|(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+    r"|(?P<unterminated>/\*|[EeBbXxNn]?'|\"|`|\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$)"
+    r"|(?P<op>.)",
+    re.S,
+)
+_MYSQL_TOKEN_RE = re.compile(
+    r"(?P<ws>\s+)"
+    r"|(?P<comment>#[^\n]*|--(?=\s|$)[^\n]*|/\*.*?\*/)"
+    r"|(?P<string>[BbXxNn]?'(?:[^'\\]|''|\\.)*'|\"(?:[^\"\\]|\"\"|\\.)*\")"
+    r"|(?P<ident>`(?:[^`]|``)*`)"
+    r"|(?P<word>[A-Za-z_][A-Za-z_0-9$]*)"
+    r"|(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+    r"|(?P<unterminated>/\*|[BbXxNn]?'|\"|`)"
+    r"|(?P<op>.)",
+    re.S,
+)
+_ESCAPE_RE = re.compile(r'\\.', re.S)
+MYSQL_DIALECTS = {'mysql', 'mariadb'}
+READ_STATEMENTS = {'SELECT', 'VALUES', 'TABLE', 'SHOW', 'EXPLAIN', 'DESCRIBE', 'DESC'}
+LIMITABLE_STATEMENTS = {'SELECT', 'VALUES', 'TABLE'}
+LOCKING_KEYWORDS = {'UPDATE', 'SHARE', 'NO', 'KEY'}
+DESTRUCTIVE_KEYWORDS = {'DELETE', 'DROP', 'ALTER', 'TRUNCATE', 'UPDATE', 'INSERT', 'MERGE', 'CREATE', 'GRANT', 'REVOKE', 'COPY', 'VACUUM', 'REINDEX', 'ATTACH', 'DETACH'}
+class Token(NamedTuple):
+    kind: str
+    value: str
+    start: int
+    end: int
+    depth: int
+class SqlAnalysis(NamedTuple):
+    statement_type: Optional[str]
+    statement_count: int
+    error: Optional[str]
+    limit_value: Optional[int] = None
+    limit_span: Optional[Tuple[int, int]] = None
+    insert_at: Optional[int] = None
+    statement_span: Optional[Tuple[int, int]] = None
+def tokenize_sql(sql: str, dialect: Optional[str] = None) -> Tuple[List[Token], Optional[str]]:
+    mysql = dialect in MYSQL_DIALECTS
+    tokens, depth = [], 0
+    for m in (_MYSQL_TOKEN_RE if mysql else _TOKEN_RE).finditer(sql):
+        kind = m.lastgroup if m.lastgroup != 'tag' else 'string'
+        if kind == 'comment' and mysql and m.group().startswith('/*!'):
+            return tokens, f'MySQL executable comments are not allowed (position {m.start()})'
+        if kind in ('ws', 'comment'):
+            continue
+        if kind == 'unterminated':
+            return tokens, f'Unterminated quote or comment at position {m.start()}'
+        if kind == 'string' and mysql and any(e in ("\\'", '\\"') for e in _ESCAPE_RE.findall(m.group())):
+            return tokens, f"Backslash-escaped quotes are not allowed; double the quote instead (position {m.start()})"
+        value = m.group().upper() if kind == 'word' else m.group()
+        if value == ')':
+            depth -= 1
+            if depth < 0:
+                return tokens, f'Unbalanced parenthesis at position {m.start()}'
+        tokens.append(Token(kind, value, m.start(), m.end(), depth))
+        if value == '(':
+            depth += 1
+    if depth:
+        return tokens, 'Unbalanced parenthesis'
+    return tokens, None
+def split_statements(tokens: List[Token]) -> List[List[Token]]:
+    statements, current = [], []
+    for tok in tokens:
+        if tok.value == ';' and tok.depth == 0:
+            if current:
+                statements.append(current)
+            current = []
+        else:
+            current.append(tok)
+    if current:
+        statements.append(current)
+    return statements
+def _skip_group(stmt: List[Token], i: int) -> int:
+    depth = stmt[i].depth
+    i += 1
+    while i < len(stmt) and not (stmt[i].value == ')' and stmt[i].depth == depth):
+        i += 1
+    return i + 1
+def _main_start(stmt: List[Token]) -> int:
+    i = 0
+    if stmt[0].value != 'WITH':
+        return i
+    i = 2 if len(stmt) > 1 and stmt[1].value == 'RECURSIVE' else 1
+    while i < len(stmt):
+        i += 1
+        if i < len(stmt) and stmt[i].value == '(':
+            i = _skip_group(stmt, i)
+        if i < len(stmt) and stmt[i].value == 'AS':
+            i += 1
+        while i < len(stmt) and stmt[i].value in ('NOT', 'MATERIALIZED'):
+            i += 1
+        if i < len(stmt) and stmt[i].value == '(':
+            i = _skip_group(stmt, i)
+        if i < len(stmt) and stmt[i].value == ',':
+            i += 1
+            continue
+        break
+    return i
+def _statement_type(stmt: List[Token], start: int) -> Optional[str]:
+    for tok in stmt[start:]:
+        if tok.kind == 'word':
+            return tok.value
+        if tok.value != '(':
+            return None
+    return None
+def _outer_limit(stmt: List[Token], start: int) -> Tuple[Optional[int], Optional[Tuple[int, int]], Optional[int]]:
+    outer = [t for t in stmt[start:] if t.depth == 0]
+    insert_at = stmt[-1].end
+    for i, tok in enumerate(outer):
+        nxt = outer[i + 1] if i + 1 < len(outer) else None
+        if tok.value == 'LIMIT' and nxt is not None:
+            if nxt.value == 'ALL':
+                return None, (nxt.start, nxt.end), None
+            if nxt.kind == 'number':
+                if i + 3 < len(outer) and outer[i + 2].value == ',' and outer[i + 3].kind == 'number':
+                    nxt = outer[i + 3]
+                return int(float(nxt.value)), (nxt.start, nxt.end), None
+            return None, None, None
+        if tok.value == 'FETCH' and nxt is not None and nxt.value in ('FIRST', 'NEXT'):
+            count = outer[i + 2] if i + 2 < len(outer) else None
+            if count is not None and count.kind == 'number':
+                return int(float(count.value)), (count.start, count.end), None
+            if count is not None and count.value in ('ROW', 'ROWS'):
+                return 1, None, None
+            return None, None, None
+        if tok.value == 'OFFSET':
+            insert_at = min(insert_at, tok.start)
+    return None, None, insert_at
+@lru_cache(maxsize=SQL_ANALYSIS_CACHE_SIZE)
+def analyze_sql(sql: str, dialect: Optional[str] = None) -> SqlAnalysis:
+    tokens, error = tokenize_sql(sql or '', dialect)
+    if error:
+        return SqlAnalysis(None, 0, error)
+    statements = split_statements(tokens)
+    if not statements:
+        return SqlAnalysis(None, 0, 'No valid SQL detected')
+    if len(statements) > 1:
+        return SqlAnalysis(None, len(statements), 'Multiple SQL statements are not allowed')
+    stmt = statements[0]
+    for i, tok in enumerate(stmt):
+        if tok.kind != 'word':
+            continue
+        if tok.value in DESTRUCTIVE_KEYWORDS:
+            return SqlAnalysis(tok.value, 1, f'Destructive SQL statements are disallowed ({tok.value}).')
+        if tok.value == 'FOR' and i + 1 < len(stmt) and stmt[i + 1].value in LOCKING_KEYWORDS:
+            return SqlAnalysis(None, 1, 'Row-locking clauses (FOR SHARE/FOR UPDATE) are disallowed.')
+    start = _main_start(stmt)
+    statement_type = _statement_type(stmt, start)
+    if statement_type not in READ_STATEMENTS:
+        return SqlAnalysis(statement_type, 1, f'Only read-only queries are allowed (got {statement_type or "unknown statement"}).')
+    if statement_type == 'SELECT' and any(t.value == 'INTO' and t.depth == 0 for t in stmt[start:]):
+        return SqlAnalysis(statement_type, 1, 'SELECT INTO is disallowed.')
+    if statement_type == 'EXPLAIN' and any(t.kind == 'word' and t.value in ('ANALYZE', 'ANALYSE') for t in stmt[start:]):
+        return SqlAnalysis(statement_type, 1, 'EXPLAIN ANALYZE executes the statement and is disallowed.')
+    if statement_type not in LIMITABLE_STATEMENTS:
+        return SqlAnalysis(statement_type, 1, None)
+    return SqlAnalysis(statement_type, 1, None, *_outer_limit(stmt, start), (stmt[0].start, stmt[-1].end))
+@lru_cache(maxsize=SQL_ANALYSIS_CACHE_SIZE)
+def apply_row_limit(sql: str, limit: int, dialect: Optional[str] = None) -> str:
+    analysis = analyze_sql(sql, dialect)
+    if analysis.error:
+        raise ValueError(analysis.error)
+    if analysis.statement_type not in LIMITABLE_STATEMENTS:
+        return sql
+    if analysis.limit_span is not None:
+        if analysis.limit_value is not None and analysis.limit_value <= limit:
+            return sql
+        start, end = analysis.limit_span
+        return f'{sql[:start]}{limit}{sql[end:]}'
+    if analysis.limit_value is not None:
+        return sql
+    if analysis.insert_at is None:
+        start, end = analysis.statement_span
+        return f'SELECT * FROM ({sql[start:end]}) AS _limited LIMIT {limit}'
+    at = analysis.insert_at
+    return f'{sql[:at].rstrip()} LIMIT {limit}{" " if at < len(sql) and not sql[at].isspace() and sql[at] != ";" else ""}{sql[at:]}'
+@lru_cache(maxsize=SQL_ANALYSIS_CACHE_SIZE)
+def normalize_sql(sql: str, dialect: Optional[str] = None) -> str:
+    tokens, _ = tokenize_sql(sql or '', dialect)
+    while tokens and tokens[-1].value == ';':
+        tokens.pop()
+    return ' '.join(t.value for t in tokens)
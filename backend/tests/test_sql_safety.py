@@ -0,0 +1,112 @@
+import os
+import sys
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sql_safety import analyze_sql, apply_row_limit
+def rejected(sql: str, dialect: str = None) -> bool:
+    return analyze_sql(sql, dialect).error is not None
+@pytest.mark.parametrize('sql', [
+    'SELECT 1; DROP TABLE t',
+    'SELECT 1; SELECT 2',
+    'SELECT 1;;SELECT 2',
+])
+def test_multiple_statements_rejected(sql):
+    assert rejected(sql)
+def test_trailing_semicolon_allowed():
+    assert not rejected('SELECT 1;')
+@pytest.mark.parametrize('sql', [
+    'SELECT 1 -- ; DROP TABLE t',
+    'SELECT 1 /* ; DROP TABLE t */',
+    "SELECT ';' AS a, 'DROP TABLE t' AS b",
+    'SELECT "drop" FROM t',
+])
+def test_comments_and_literals_ignored(sql):
+    assert not rejected(sql)
+def test_unterminated_comment_rejected():
+    assert rejected('SELECT 1 /* ; DROP TABLE t')
+@pytest.mark.parametrize('sql', [
+    'SELECT $$ ; DROP TABLE t $$',
+    'SELECT $body$ ; DROP TABLE t $body$',
+])
+def test_dollar_quotes_are_literals(sql):
+    assert not rejected(sql, 'postgresql')
+def test_unterminated_dollar_quote_rejected():
+    assert rejected('SELECT $x$ ; DROP TABLE t')
+def test_backslash_is_literal_in_standard_strings():
+    assert not rejected("SELECT 'a\\' AS x", 'postgresql')
+    assert rejected("SELECT E'a\\'' ; DROP TABLE t; SELECT '", 'postgresql')
+@pytest.mark.parametrize('sql', [
+    "SELECT 'a\\'' ; DROP TABLE t; SELECT '",
+    'SELECT "a\\"" ; DROP TABLE t; SELECT "',
+    "SELECT 'it\\'s'",
+])
+def test_mysql_backslash_escaped_quotes_rejected(sql):
+    assert rejected(sql, 'mysql')
+def test_mysql_doubled_quotes_and_escaped_backslashes_allowed():
+    assert not rejected("SELECT 'it''s', 'a\\\\' FROM t", 'mysql')
+@pytest.mark.parametrize('sql', [
+    'SELECT 1 # ; DROP TABLE t',
+    'SELECT 1 -- ; DROP TABLE t',
+])
+def test_mysql_comments(sql):
+    assert not rejected(sql, 'mysql')
+def test_mysql_double_dash_without_space_is_not_a_comment():
+    assert rejected('SELECT 1--1; DROP TABLE t', 'mysql')
+    assert rejected('SELECT 1--1; DROP TABLE t', 'postgresql') is False
+def test_mysql_executable_comment_rejected():
+    assert rejected('SELECT 1 /*!50000 ; DROP TABLE t */', 'mysql')
+@pytest.mark.parametrize('sql', [
+    'WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d',
+    'WITH u AS (UPDATE t SET a = 1 RETURNING *) SELECT * FROM u',
+    'WITH i AS (INSERT INTO t VALUES (1) RETURNING *) SELECT * FROM i',
+    'INSERT INTO t SELECT * FROM s',
+])
+def test_cte_and_insert_dml_rejected(sql):
+    assert rejected(sql)
+def test_cte_select_allowed():
+    analysis = analyze_sql('WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT x FROM c')
+    assert analysis.error is None
+    assert analysis.statement_type == 'SELECT'
+@pytest.mark.parametrize('sql', [
+    'SELECT * INTO new_t FROM t',
+    "SELECT * FROM t INTO OUTFILE '/tmp/x'",
+])
+def test_select_into_rejected(sql):
+    assert rejected(sql)
+@pytest.mark.parametrize('sql', [
+    'SELECT * FROM t FOR UPDATE',
+    'SELECT * FROM t FOR SHARE',
+    'SELECT * FROM t FOR NO KEY UPDATE',
+])
+def test_row_locking_rejected(sql):
+    assert rejected(sql)
+@pytest.mark.parametrize('sql', [
+    'EXPLAIN ANALYZE SELECT * FROM t',
+    'EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM t',
+    'EXPLAIN ANALYSE SELECT * FROM t',
+])
+def test_explain_analyze_rejected(sql):
+    assert rejected(sql)
+def test_explain_allowed_and_not_limited():
+    assert not rejected('EXPLAIN SELECT * FROM t')
+    assert apply_row_limit('EXPLAIN SELECT * FROM t', 10) == 'EXPLAIN SELECT * FROM t'
+def test_limit_appended():
+    assert apply_row_limit('SELECT * FROM t', 100) == 'SELECT * FROM t LIMIT 100'
+def test_limit_clamped():
+    assert apply_row_limit('SELECT * FROM t LIMIT 5000', 100) == 'SELECT * FROM t LIMIT 100'
+    assert apply_row_limit('SELECT * FROM t LIMIT 5', 100) == 'SELECT * FROM t LIMIT 5'
+def test_limit_all_clamped():
+    assert apply_row_limit('SELECT * FROM t LIMIT ALL', 100) == 'SELECT * FROM t LIMIT 100'
+def test_mysql_offset_limit_clamped():
+    assert apply_row_limit('SELECT * FROM t LIMIT 10, 5000', 100) == 'SELECT * FROM t LIMIT 10, 100'
+def test_limit_inserted_before_offset():
+    assert apply_row_limit('SELECT * FROM t OFFSET 10', 100) == 'SELECT * FROM t LIMIT 100 OFFSET 10'
+def test_inner_limit_does_not_count():
+    assert apply_row_limit('SELECT * FROM (SELECT * FROM t LIMIT 5) s', 100) == 'SELECT * FROM (SELECT * FROM t LIMIT 5) s LIMIT 100'
+def test_limit_like_identifiers_ignored():
+    assert apply_row_limit('SELECT limit_amount FROM t', 100) == 'SELECT limit_amount FROM t LIMIT 100'
+def test_cte_limited_on_outer_query():
+    sql = 'WITH a AS (SELECT * FROM t LIMIT 5000) SELECT * FROM a'
+    assert apply_row_limit(sql, 100) == f'{sql} LIMIT 100'
+def test_fetch_first_clamped():
+    assert apply_row_limit('SELECT * FROM t FETCH FIRST 5000 ROWS ONLY', 100) == 'SELECT * FROM t FETCH FIRST 100 ROWS ONLY'
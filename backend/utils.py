@@ -1,8 +1,24 @@
 import re
-from typing import List
-DANGEROUS_SQL_PATTERNS = [r"\bDELETE\b", r"\bDROP\b", r"\bALTER\b", r"\bTRUNCATE\b", r"\bUPDATE\b"]
-def is_destructive(sql: str) -> bool:
-    sql_up = sql.upper()
-    return any(re.search(pat, sql_up) for pat in DANGEROUS_SQL_PATTERNS)
+import base64
+from datetime import datetime
+from typing import List, Tuple
+_TOKEN_RE = re.compile(r'[A-Za-z0-9_]+')
+_CAMEL_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+')
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for word in _TOKEN_RE.findall(text or ''):
+        lower = word.lower()
+        tokens.append(lower)
+        parts = [p.lower() for piece in word.split('_') for p in _CAMEL_RE.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
 def sanitize_identifier(s: str) -> str:
     return re.sub(r"[^0-9A-Za-z_\-]", "_", s)
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{row_id}".encode('utf-8')).decode('ascii')
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    created_at, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+    return datetime.fromisoformat(created_at), int(row_id)
+def fts_match_expression(q: str) -> str:
+    return ' '.join('"' + tok.replace('"', '""') + '"*' for tok in q.split())
@@ -1,49 +1,201 @@
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
 import os
-from typing import List, Dict
+import time
+import json
+import re
+import hashlib
+from contextlib import nullcontext
+from typing import List, Dict, Tuple
 from utils import sanitize_identifier
+from cache import TTLCache
+from metrics import timed, cache_event
+from numpy_index import get_numpy_collection
+from embedding_service import MicroBatcher, remote_encode, EMBEDDING_SERVICE_URL
 CHROMA_DIR = os.environ.get('CHROMA_PERSIST_DIR', '/data/chroma')
+VECTOR_BACKEND = os.environ.get('VECTOR_BACKEND', 'chroma')
 EMBED_MODEL_NAME = os.environ.get('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '256'))
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', '2048'))
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', '600'))
+INDEX_COLUMNS = os.environ.get('INDEX_COLUMNS', '1') == '1'
+COLUMN_COLLECTION_SUFFIX = '__columns'
 _chroma_client = None
 _model = None
+_query_batcher = None
+_embedding_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+_search_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
 def _get_model():
     global _model
     if _model is None:
+        from sentence_transformers import SentenceTransformer
         _model = SentenceTransformer(EMBED_MODEL_NAME)
     return _model
 def _get_chroma_client():
     global _chroma_client
     if _chroma_client is None:
+        import chromadb
+        from chromadb.config import Settings
         settings = Settings(persist_directory=CHROMA_DIR)
         _chroma_client = chromadb.Client(settings=settings)
     return _chroma_client
-def ensure_collection(schema: str):
+def ensure_collection(schema: str, columns: bool = False):
+    col_name = sanitize_identifier(schema) + (COLUMN_COLLECTION_SUFFIX if columns else '')
+    if VECTOR_BACKEND == 'numpy':
+        return get_numpy_collection(col_name)
     client = _get_chroma_client()
-    col_name = sanitize_identifier(schema)
     try:
         return client.get_collection(col_name)
     except Exception:
         return client.create_collection(col_name)
-def upsert_metadata_embeddings(schema: str, metadata_entries: List[Dict]):
-    model = _get_model()
-    client = _get_chroma_client()
+def _local_encode(texts: List[str]) -> List[List[float]]:
+    return _get_model().encode(texts, show_progress_bar=False, convert_to_numpy=True).tolist()
+def _get_query_batcher() -> MicroBatcher:
+    global _query_batcher
+    if _query_batcher is None:
+        _query_batcher = MicroBatcher(remote_encode if EMBEDDING_SERVICE_URL else _local_encode)
+    return _query_batcher
+def warm_up() -> float:
+    started = time.monotonic()
+    _get_query_batcher().encode('warm up')
+    if VECTOR_BACKEND != 'numpy':
+        _get_chroma_client()
+    return time.monotonic() - started
+def normalize_query(query: str) -> str:
+    return re.sub(r'\s+', ' ', query or '').strip().rstrip('?!. ').lower()
+def _collection_metadata(col) -> Dict:
+    if hasattr(col, 'refresh'):
+        col.refresh()
+    return col.metadata or {}
+def get_index_version(schema: str) -> int:
+    return int(_collection_metadata(ensure_collection(schema)).get('index_version', 0))
+def _bump_index_version(col, schema: str):
+    meta = {k: v for k, v in _collection_metadata(col).items() if not k.startswith('hnsw:')}
+    meta['index_version'] = int(meta.get('index_version', 0)) + 1
+    col.modify(metadata=meta)
+    _search_cache.invalidate(lambda key: key[0] == schema)
+def embed_query(query: str) -> List[float]:
+    key = (EMBED_MODEL_NAME, normalize_query(query))
+    emb = _embedding_cache.get(key)
+    cache_event('query_embedding', emb is not None)
+    if emb is None:
+        with timed('embed'):
+            emb = _get_query_batcher().encode(key[1])
+        _embedding_cache.set(key, emb)
+    return emb
+def cache_stats() -> Dict[str, dict]:
+    return {'query_embeddings': _embedding_cache.stats(), 'search_results': _search_cache.stats(), 'embedding_batches': _get_query_batcher().stats()}
+def _content_hash(entry: Dict) -> str:
+    payload = json.dumps(entry, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+def _to_chroma_metadata(entry: Dict, content_hash: str) -> Dict:
+    meta = {}
+    for k, v in entry.items():
+        if k == 'readable' or v is None:
+            continue
+        meta[k] = v if isinstance(v, (str, int, float, bool)) else json.dumps(v, default=str)
+    meta['content_hash'] = content_hash
+    meta['embed_model'] = EMBED_MODEL_NAME
+    return meta
+def _from_chroma_metadata(meta: Dict) -> Dict:
+    out = dict(meta or {})
+    for k in ('columns', 'foreign_keys', 'primary_key'):
+        if isinstance(out.get(k), str):
+            try:
+                out[k] = json.loads(out[k])
+            except ValueError:
+                pass
+    return out
+def column_entries(entry: Dict) -> List[Dict]:
+    out = []
+    for c in entry.get('columns') or []:
+        readable = f"Column {entry['schema']}.{entry['name']}.{c['name']} ({c['type']})"
+        if c.get('comment'):
+            readable += f" -- {c['comment']}"
+        out.append({'id': f"{entry['id']}.{c['name']}", 'type': 'column', 'name': c['name'], 'schema': entry['schema'], 'table_id': entry['id'], 'table': entry['name'], 'data_type': c['type'], 'readable': readable})
+    return out
+def _sync_collection(col, entries: List[Dict], stats: Dict[str, int], prune: bool = True) -> bool:
+    if not entries and not prune:
+        return False
+    with col.writing() if hasattr(col, 'writing') else nullcontext():
+        existing = col.get(include=['metadatas']) if prune else col.get(ids=[e.get('id') for e in entries], include=['metadatas'])
+        known = {_id: (m or {}) for _id, m in zip(existing.get('ids') or [], existing.get('metadatas') or [])}
+        pending = []
+        seen = set()
+        for e in entries:
+            _id = e.get('id')
+            seen.add(_id)
+            h = _content_hash(e)
+            prev = known.get(_id)
+            if prev is not None and prev.get('content_hash') == h and prev.get('embed_model') == EMBED_MODEL_NAME:
+                stats['skipped'] += 1
+                continue
+            stats['changed' if prev is not None else 'added'] += 1
+            pending.append((_id, e.get('readable') or '', _to_chroma_metadata(e, h)))
+        removed = [_id for _id in known if _id not in seen] if prune else []
+        if pending:
+            encode = remote_encode if EMBEDDING_SERVICE_URL else _local_encode
+            for i in range(0, len(pending), EMBED_BATCH_SIZE):
+                batch = pending[i:i + EMBED_BATCH_SIZE]
+                texts = [t for _, t, _ in batch]
+                col.upsert(ids=[b[0] for b in batch], metadatas=[b[2] for b in batch], documents=texts, embeddings=encode(texts))
+        if removed:
+            col.delete(ids=removed)
+            stats['removed'] += len(removed)
+    return bool(pending or removed)
+@timed('index_upsert')
+def upsert_metadata_embeddings(schema: str, metadata_entries: List[Dict], prune: bool = True) -> Dict[str, int]:
     col = ensure_collection(schema)
-    texts = [e.get('readable') or '' for e in metadata_entries]
-    ids = [e.get('id') for e in metadata_entries]
-    embeddings = model.encode(texts, show_progress_bar=False, convert_to_numpy=True)
-    metadatas = [{k: v for k, v in e.items() if k != 'readable'} for e in metadata_entries]
-    col.upsert(ids=ids, metadatas=metadatas, documents=texts, embeddings=embeddings.tolist())
-    return True
-def semantic_search(schema: str, query: str, k: int = 5):
-    model = _get_model()
-    client = _get_chroma_client()
+    stats = {'added': 0, 'changed': 0, 'removed': 0, 'skipped': 0}
+    changed = _sync_collection(col, metadata_entries, stats, prune=prune)
+    if INDEX_COLUMNS:
+        columns = [c for e in metadata_entries for c in column_entries(e)]
+        changed = _sync_collection(ensure_collection(schema, columns=True), columns, stats, prune=prune) or changed
+    if changed:
+        _bump_index_version(col, schema)
+    return stats
+def prune_missing(schema: str, keep_ids: set) -> int:
     col = ensure_collection(schema)
-    q_emb = model.encode([query], show_progress_bar=False, convert_to_numpy=True)[0].tolist()
-    results = col.query(query_embeddings=[q_emb], n_results=k, include=['metadatas', 'distances', 'documents', 'ids'])
+    removed = [_id for _id in col.get(include=[]).get('ids') or [] if _id not in keep_ids]
+    if removed:
+        col.delete(ids=removed)
+    if INDEX_COLUMNS:
+        col_cols = ensure_collection(schema, columns=True)
+        existing = col_cols.get(include=['metadatas'])
+        orphans = [_id for _id, m in zip(existing.get('ids') or [], existing.get('metadatas') or []) if (m or {}).get('table_id') not in keep_ids]
+        if orphans:
+            col_cols.delete(ids=orphans)
+            removed.extend(orphans)
+    if removed:
+        _bump_index_version(col, schema)
+    return len(removed)
+@timed('vector_query')
+def _query_collection(col, q_emb: List[float], n: int) -> List[Dict]:
+    count = col.count()
+    if count == 0:
+        return []
+    results = col.query(query_embeddings=[q_emb], n_results=min(n, count), include=['metadatas', 'distances', 'documents'])
     out = []
     if results and 'ids' in results and len(results['ids'])>0:
         for i, _id in enumerate(results['ids'][0]):
-            out.append({'id': _id, 'document': results['documents'][0][i], 'metadata': results['metadatas'][0][i], 'distance': results['distances'][0][i]})
+            out.append({'id': _id, 'document': results['documents'][0][i], 'metadata': _from_chroma_metadata(results['metadatas'][0][i]), 'distance': results['distances'][0][i]})
     return out
+def vector_query(schema: str, query: str, n: int, columns: bool = False) -> List[Dict]:
+    return _query_collection(ensure_collection(schema, columns=columns), embed_query(query), n)
+def get_entries(schema: str, ids: List[str]) -> List[Dict]:
+    if not ids:
+        return []
+    data = ensure_collection(schema).get(ids=ids, include=['documents', 'metadatas'])
+    return [{'id': _id, 'document': doc, 'metadata': _from_chroma_metadata(meta), 'distance': None} for _id, doc, meta in zip(data.get('ids') or [], data.get('documents') or [], data.get('metadatas') or [])]
+def get_documents(schema: str, columns: bool = False) -> Tuple[List[str], List[str], List[Dict]]:
+    data = ensure_collection(schema, columns=columns).get(include=['documents', 'metadatas'])
+    return data.get('ids') or [], data.get('documents') or [], [_from_chroma_metadata(m) for m in data.get('metadatas') or []]
+def semantic_search(schema: str, query: str, k: int = 5):
+    col = ensure_collection(schema)
+    version = int(_collection_metadata(col).get('index_version', 0))
+    key = (schema, normalize_query(query), k, version)
+    cached = _search_cache.get(key)
+    cache_event('semantic_search', cached is not None)
+    if cached is not None:
+        return [dict(r) for r in cached]
+    out = _query_collection(col, embed_query(query), k)
+    _search_cache.set(key, out)
+    return [dict(r) for r in out]
@@ -1,7 +1,9 @@
 import streamlit as st
 import requests
 import pandas as pd
+import pyarrow as pa
 import os
+import time
 from datetime import datetime
 BACKEND_URL = os.environ.get('BACKEND_URL', 'http://backend:8000')
 st.set_page_config(page_title='AI Metadata-to-SQL', layout='wide')
@@ -12,6 +14,23 @@ if 'role' not in st.session_state:
     st.session_state['role'] = None
 if 'username' not in st.session_state:
     st.session_state['username'] = None
+def run_extract_job(conn_str, schema, db_type, headers):
+    resp = requests.post(f'{BACKEND_URL}/extract_jobs', json={'conn_str': conn_str, 'schemas': [s.strip() for s in schema.split(',') if s.strip()], 'db_type': db_type}, timeout=20, headers=headers)
+    resp.raise_for_status()
+    job = resp.json()
+    bar = st.progress(0.0, text='Extracting metadata...')
+    while job.get('status') in ('queued', 'running'):
+        time.sleep(1)
+        resp = requests.get(f"{BACKEND_URL}/extract_jobs/{job['job_id']}", timeout=20, headers=headers)
+        resp.raise_for_status()
+        job = resp.json()
+        progress = job.get('progress') or {}
+        done = sum(1 for p in progress.values() if p.get('status') not in ('queued', 'running'))
+        extracted = sum(p.get('extracted', 0) for p in progress.values())
+        bar.progress(done / max(len(progress), 1), text=f'{extracted} entries extracted')
+    if job.get('status') != 'succeeded':
+        raise RuntimeError(job.get('error') or f"Job {job.get('status')}")
+    return sum(p.get('extracted', 0) for p in (job.get('progress') or {}).values())
 with st.sidebar:
     st.header('Authentication')
     if st.session_state['token'] is None:
@@ -59,16 +78,14 @@ with st.sidebar:
         if st.button('Generate Metadata & Index'):
             try:
                 headers = {'Authorization': f'Bearer {st.session_state.get("token")}'}
-                resp = requests.post(f'{BACKEND_URL}/extract_metadata', json={'conn_str': conn_str, 'schema': schema, 'db_type': db_type}, timeout=120, headers=headers)
-                resp.raise_for_status()
-                st.success(f"Indexed {resp.json().get('count')} metadata entries")
+                count = run_extract_job(conn_str, schema, db_type, headers)
+                st.success(f"Indexed {count} metadata entries")
             except Exception as e:
                 st.error(f'Extraction failed: {e}')
         if st.button('Reload Schema (Admin only)'):
             try:
                 headers = {'Authorization': f'Bearer {st.session_state.get("token")}'}
-                resp = requests.post(f'{BACKEND_URL}/extract_metadata', json={'conn_str': conn_str, 'schema': schema, 'db_type': db_type}, timeout=120, headers=headers)
-                resp.raise_for_status()
+                run_extract_job(conn_str, schema, db_type, headers)
                 st.success('Schema reloaded and re-indexed.')
             except Exception as e:
                 st.error(f'Reload failed: {e}')
@@ -95,29 +112,48 @@ with col2:
                     context = data.get('context')
                     st.subheader('Generated SQL')
                     st.code(sql, language='sql')
+                    plan = data.get('plan')
+                    if plan:
+                        if plan.get('verdict') == 'reject':
+                            st.error(f"Query blocked: {plan.get('reason')}")
+                        elif plan.get('verdict') in ('confirm', 'error'):
+                            st.warning(plan.get('reason'))
+                        st.caption(f"Estimated cost: {plan.get('total_cost')} · estimated rows: {plan.get('rows')}")
+                    confirm = st.checkbox('Run even if the estimated cost is high', value=False)
+                    no_cache = st.checkbox('Bypass result cache', value=False)
                     if context:
                         st.subheader('Retrieved Schema Context')
                         for c in context:
                             st.markdown(f"**{c.get('id')}** — {c.get('document')}")
                     if st.button('Execute SQL'):
                         headers = {'Authorization': f'Bearer {st.session_state.get("token")}'}
-                        exec_resp = requests.post(f'{BACKEND_URL}/execute_sql', json={'conn_str': conn_str, 'sql': sql}, timeout=120, headers=headers)
-                        exec_resp.raise_for_status()
-                        out = exec_resp.json()
-                        df = pd.DataFrame(out['data'])
-                        st.success(f"Returned {out['rows']} rows")
-                        st.dataframe(df)
-                        st.subheader('Chart view')
-                        numeric_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
-                        if numeric_cols:
-                            x = st.selectbox('X axis', options=df.columns, index=0)
-                            y = st.selectbox('Y axis', options=numeric_cols, index=0)
-                            import plotly.express as px
-                            fig = px.bar(df, x=x, y=y)
-                            st.plotly_chart(fig, use_container_width=True)
+                        exec_resp = requests.post(f'{BACKEND_URL}/execute_sql', json={'conn_str': conn_str, 'sql': sql, 'format': 'arrow', 'confirm': confirm, 'no_cache': no_cache}, timeout=120, headers=headers)
+                        detail = exec_resp.json().get('detail') if exec_resp.status_code in (403, 409) else None
+                        if isinstance(detail, dict):
+                            blocked = detail.get('plan') or {}
+                            if detail.get('needs_confirmation'):
+                                st.warning(f"{detail.get('message')}. Tick 'Run even if the estimated cost is high' and execute again to run it anyway.")
+                            else:
+                                st.error(f"Query blocked: {detail.get('message')}")
+                            st.caption(f"Estimated cost: {blocked.get('total_cost')} · estimated rows: {blocked.get('rows')}")
+                            if blocked.get('seq_scans'):
+                                st.caption(f"Sequential scans: {', '.join(blocked['seq_scans'])}")
                         else:
-                            st.info('No numeric columns to chart')
-                        st.download_button('Download CSV', data=out['csv'], file_name=f'result_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
+                            exec_resp.raise_for_status()
+                            df = pa.ipc.open_stream(exec_resp.content).read_pandas()
+                            st.success(f"Returned {len(df)} rows")
+                            st.dataframe(df)
+                            st.subheader('Chart view')
+                            numeric_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+                            if numeric_cols:
+                                x = st.selectbox('X axis', options=df.columns, index=0)
+                                y = st.selectbox('Y axis', options=numeric_cols, index=0)
+                                import plotly.express as px
+                                fig = px.bar(df, x=x, y=y)
+                                st.plotly_chart(fig, use_container_width=True)
+                            else:
+                                st.info('No numeric columns to chart')
+                            st.download_button('Download CSV', data=df.to_csv(index=False), file_name=f'result_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
                 except Exception as e:
                     st.error(f'Error: {e}')
 if st.sidebar.button('Show my query history'):